@@ -0,0 +1,49 @@
+"""index favorites foreign keys and make (user, target) unique
+
+Revision ID: 3f9c2d7b41e8
+Revises: 67a55bfa32e1
+Create Date: 2026-10-17 09:12:44.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9c2d7b41e8'
+down_revision = '67a55bfa32e1'
+branch_labels = None
+depends_on = None
+
+TARGET_COLUMNS = {
+    'film': 'film_id',
+    'specie': 'specie_id',
+    'starship': 'starship_id',
+    'vehicle': 'vehicle_id',
+    'character': 'character_id',
+    'planet': 'planet_id',
+}
+
+
+def upgrade():
+    # Drop duplicate favorites (keeping the oldest) so the unique indexes can be built.
+    # The kept ids go through a derived table: MySQL refuses a subquery on the
+    # table being deleted from (error 1093) but materializes a derived one,
+    # which its GROUP BY keeps from being merged back into the DELETE.
+    for column in TARGET_COLUMNS.values():
+        op.execute(
+            'DELETE FROM favorites WHERE {col} IS NOT NULL AND id NOT IN ('
+            'SELECT id FROM (SELECT MIN(id) AS id FROM favorites WHERE {col} IS NOT NULL GROUP BY user_id, {col}) AS kept)'.format(col=column)
+        )
+
+    with op.batch_alter_table('favorites', schema=None) as batch_op:
+        for kind, column in TARGET_COLUMNS.items():
+            batch_op.create_index(batch_op.f('ix_favorites_' + column), [column], unique=False)
+            batch_op.create_index('uq_favorites_user_' + kind, ['user_id', column], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('favorites', schema=None) as batch_op:
+        for kind, column in TARGET_COLUMNS.items():
+            batch_op.drop_index('uq_favorites_user_' + kind)
+            batch_op.drop_index(batch_op.f('ix_favorites_' + column))
@@ -0,0 +1,55 @@
+"""favorite_count summary table
+
+Revision ID: a9d3f6b2c8e4
+Revises: f7b2d9c4e1a3
+Create Date: 2026-10-17 21:03:37.642915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9d3f6b2c8e4'
+down_revision = 'f7b2d9c4e1a3'
+branch_labels = None
+depends_on = None
+
+# favorites kind -> favorites column, as in models.FAVORITE_TARGETS
+FAVORITE_COLUMNS = {
+    'film': 'film_id',
+    'species': 'specie_id',
+    'starship': 'starship_id',
+    'vehicle': 'vehicle_id',
+    'character': 'character_id',
+    'planet': 'planet_id',
+}
+
+
+def upgrade():
+    op.create_table('favorite_count',
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('target_id', sa.Integer(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('kind', 'target_id')
+    )
+    with op.batch_alter_table('favorite_count', schema=None) as batch_op:
+        batch_op.create_index('ix_favorite_count_count', ['count'], unique=False)
+        batch_op.create_index('ix_favorite_count_kind_count', ['kind', 'count'], unique=False)
+
+    summary = sa.table('favorite_count', sa.column('kind'), sa.column('target_id'), sa.column('count'))
+    for kind, column_name in FAVORITE_COLUMNS.items():
+        column = sa.column(column_name)
+        source = (sa.select(sa.literal(kind), column, sa.func.count())
+                  .select_from(sa.table('favorites', column))
+                  .where(column.isnot(None))
+                  .group_by(column))
+        op.execute(summary.insert().from_select(['kind', 'target_id', 'count'], source))
+
+
+def downgrade():
+    with op.batch_alter_table('favorite_count', schema=None) as batch_op:
+        batch_op.drop_index('ix_favorite_count_kind_count')
+        batch_op.drop_index('ix_favorite_count_count')
+
+    op.drop_table('favorite_count')
@@ -0,0 +1,26 @@
+"""make character.url unique so SWAPI imports can upsert on it
+
+Revision ID: b81e4f0c2a6d
+Revises: 3f9c2d7b41e8
+Create Date: 2026-10-17 11:40:27.093811
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b81e4f0c2a6d'
+down_revision = '3f9c2d7b41e8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('character', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_character_url', ['url'])
+
+
+def downgrade():
+    with op.batch_alter_table('character', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_character_url', type_='unique')
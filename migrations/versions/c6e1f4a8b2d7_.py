@@ -0,0 +1,30 @@
+"""table_generation counters for list ETags
+
+Revision ID: c6e1f4a8b2d7
+Revises: a9d3f6b2c8e4
+Create Date: 2026-10-18 10:14:26.903517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6e1f4a8b2d7'
+down_revision = 'a9d3f6b2c8e4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # No rows yet: the first write to each table inserts its counter.
+    op.create_table('table_generation',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('generation', sa.Integer(), nullable=False),
+    sa.Column('changed', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('table_generation')
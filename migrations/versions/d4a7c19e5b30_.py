@@ -0,0 +1,48 @@
+"""full-text search index over the catalog
+
+Revision ID: d4a7c19e5b30
+Revises: b81e4f0c2a6d
+Create Date: 2026-10-17 14:05:52.771340
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from search import create_index_table
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a7c19e5b30'
+down_revision = 'b81e4f0c2a6d'
+branch_labels = None
+depends_on = None
+
+# table, kind, code, name columns, body column (mirrors search.SEARCH_RESOURCES)
+SOURCES = [
+    ('character', 'characters', 1, ['name'], None),
+    ('planet', 'planets', 2, ['name'], None),
+    ('starship', 'starships', 3, ['name', 'model'], None),
+    ('vehicle', 'vehicles', 4, ['name', 'model'], None),
+    ('species', 'species', 5, ['name'], None),
+    ('film', 'films', 6, ['title'], 'opening_crawl'),
+]
+
+
+def upgrade():
+    create_index_table(op.get_bind())
+    key = 'rowid' if op.get_bind().dialect.name == 'sqlite' else 'id'
+
+    index = sa.table('search_index', sa.column(key), sa.column('kind'), sa.column('entity_id'),
+                     sa.column('name'), sa.column('body'))
+    for table_name, kind, code, name_columns, body_column in SOURCES:
+        text_columns = name_columns + ([body_column] if body_column else [])
+        table = sa.table(table_name, sa.column('id', sa.Integer), *[sa.column(name, sa.String) for name in text_columns])
+        name = sa.func.coalesce(table.c[name_columns[0]], '')
+        for column in name_columns[1:]:
+            name = name + ' ' + sa.func.coalesce(table.c[column], '')
+        body = sa.func.coalesce(table.c[body_column], '') if body_column else sa.literal('')
+        source = sa.select(table.c.id * 8 + code, sa.literal(kind), table.c.id, name, body)
+        op.execute(index.insert().from_select([key, 'kind', 'entity_id', 'name', 'body'], source))
+
+
+def downgrade():
+    op.drop_table('search_index')
@@ -0,0 +1,33 @@
+"""widen character.gender for SWAPI's longest value, hermaphrodite
+
+Revision ID: e2b8f5a1c7d4
+Revises: c6e1f4a8b2d7
+Create Date: 2026-10-18 16:02:37.214809
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b8f5a1c7d4'
+down_revision = 'c6e1f4a8b2d7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('character', schema=None) as batch_op:
+        batch_op.alter_column('gender',
+               existing_type=sa.String(length=10),
+               type_=sa.String(length=20),
+               existing_nullable=True)
+
+
+def downgrade():
+    # Fails where a stored gender no longer fits in 10 characters.
+    with op.batch_alter_table('character', schema=None) as batch_op:
+        batch_op.alter_column('gender',
+               existing_type=sa.String(length=20),
+               type_=sa.String(length=10),
+               existing_nullable=True)
@@ -0,0 +1,66 @@
+"""numeric shadow columns for the SWAPI string stats
+
+Revision ID: e5c3a8f17d92
+Revises: d4a7c19e5b30
+Create Date: 2026-10-17 16:22:08.360415
+
+"""
+import re
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5c3a8f17d92'
+down_revision = 'd4a7c19e5b30'
+branch_labels = None
+depends_on = None
+
+NUMERIC_COLUMNS = {
+    'starship': ['cost_in_credits', 'length', 'crew', 'passengers', 'max_atmosphering_speed',
+                 'hyperdrive_rating', 'MGLT', 'cargo_capacity'],
+    'vehicle': ['cost_in_credits', 'length', 'crew', 'passengers', 'max_atmosphering_speed', 'cargo_capacity'],
+    'species': ['average_height', 'average_lifespan'],
+    'planet': ['diameter', 'rotation_period', 'orbital_period', 'population', 'surface_water'],
+    'character': ['height', 'mass'],
+}
+
+
+def parse_number(value):
+    # Frozen copy of models.parse_number so this migration never changes meaning.
+    if value is None:
+        return None
+    match = re.search(r'-?\d+(?:\.\d+)?', str(value).replace(',', ''))
+    return float(match.group()) if match else None
+
+
+def upgrade():
+    for table_name, columns in NUMERIC_COLUMNS.items():
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            for column in columns:
+                batch_op.add_column(sa.Column(column + '_num', sa.Float(), nullable=True))
+                batch_op.create_index(batch_op.f('ix_%s_%s_num' % (table_name, column)), [column + '_num'], unique=False)
+
+    connection = op.get_bind()
+    for table_name, columns in NUMERIC_COLUMNS.items():
+        table = sa.table(table_name, sa.column('id', sa.Integer),
+                         *[sa.column(column, sa.String) for column in columns],
+                         *[sa.column(column + '_num', sa.Float) for column in columns])
+        rows = connection.execute(sa.select(table.c.id, *[table.c[column] for column in columns])).all()
+        updates = [
+            dict({'row_id': row.id}, **{column + '_num': parse_number(row._mapping[column]) for column in columns})
+            for row in rows
+        ]
+        if updates:
+            statement = table.update().where(table.c.id == sa.bindparam('row_id')).values(
+                **{column + '_num': sa.bindparam(column + '_num') for column in columns}
+            )
+            connection.execute(statement, updates)
+
+
+def downgrade():
+    for table_name, columns in NUMERIC_COLUMNS.items():
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            for column in columns:
+                batch_op.drop_index(batch_op.f('ix_%s_%s_num' % (table_name, column)))
+                batch_op.drop_column(column + '_num')
@@ -0,0 +1,30 @@
+"""row version on the catalog tables for If-Match updates
+
+Revision ID: f7b2d9c4e1a3
+Revises: e5c3a8f17d92
+Create Date: 2026-10-17 19:41:52.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f7b2d9c4e1a3'
+down_revision = 'e5c3a8f17d92'
+branch_labels = None
+depends_on = None
+
+CATALOG_TABLES = ('film', 'starship', 'vehicle', 'species', 'planet', 'character')
+
+
+def upgrade():
+    for table_name in CATALOG_TABLES:
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    for table_name in reversed(CATALOG_TABLES):
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.drop_column('version')
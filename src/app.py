@@ -2,15 +2,28 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
-from flask import Flask, request, jsonify, url_for
+import time
+from flask import Flask, Response, request, jsonify, url_for, stream_with_context
 from flask_migrate import Migrate
 from flask_swagger import swagger
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
+from sqlalchemy import or_, select, exists, literal, delete, update, bindparam, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload, RelationshipDirection
+from utils import APIException, generate_sitemap, get_int_arg, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, paginate_by_id, page_response, catalog_page, get_expand_arg, conditional_get, FastJSONProvider, get_include_arg, include_related, parse_changes, if_match_versions, validator_statement, validators
 from admin import setup_admin
-from models import db, User, Film, Starship, Vehicle, Species, Planet, Character, favorites
+from commands import setup_commands
+from replicas import REPLICA_BIND_PREFIX, replica_binds, setup_replicas
+from metrics import setup_metrics
+from profiler import setup_profiler
+from cache import cache
+import search
+import stats
+from models import db, User, Film, Starship, Vehicle, Species, Planet, Character, favorites, FAVORITE_TARGETS, CATALOG_MODELS, insert_ignoring_duplicates, parse_number
+from models import FAVORITE_KINDS, increment_favorite_counts, decrement_favorite_counts, drop_favorite_counts
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 app.url_map.strict_slashes = False
 
 db_url = os.getenv("DATABASE_URL")
@@ -20,10 +33,49 @@ else:
     app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Connection pool, tuned per deployment through the environment. pre_ping and
+# recycle drop connections that died in a failover before a request uses them.
+engine_options = {
+    'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', '1') != '0',
+    'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+}
+if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    engine_options['pool_size'] = int(os.getenv('DB_POOL_SIZE', 5))
+    engine_options['max_overflow'] = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    engine_options['pool_timeout'] = int(os.getenv('DB_POOL_TIMEOUT', 30))
+statement_timeout = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 0))
+if statement_timeout:
+    if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql'):
+        engine_options['connect_args'] = {'options': '-c statement_timeout=%d' % statement_timeout}
+    elif app.config['SQLALCHEMY_DATABASE_URI'].startswith('mysql'):
+        engine_options['connect_args'] = {'init_command': 'SET SESSION max_execution_time=%d' % statement_timeout}
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+app.config['SQLALCHEMY_BINDS'] = replica_binds(engine_options)
+
 MIGRATE = Migrate(app, db)
 db.init_app(app)
+cache.init_app(app)
 CORS(app)
 setup_admin(app)
+setup_commands(app)
+setup_replicas(app)
+setup_metrics(app)
+setup_profiler(app)
+
+# Relationships read by each serialize(), loaded up front so a page of N rows
+# costs a fixed number of queries instead of one lazy SELECT per row.
+CHARACTER_LOADS = (joinedload(Character.homeworld), joinedload(Character.film))
+FAVORITE_LOADS = (
+    joinedload(favorites.film),
+    joinedload(favorites.species),
+    joinedload(favorites.starship),
+    joinedload(favorites.vehicle),
+    joinedload(favorites.character),
+    joinedload(favorites.planet)
+)
+# Only used for ?expand=favorites: one SELECT ... IN for the page's favorites,
+# with their targets joined in, regardless of how many users are on the page.
+USER_FAVORITES_LOADS = (selectinload(User.favorites).options(*FAVORITE_LOADS),)
 
 @app.errorhandler(APIException)
 def handle_invalid_usage(error):
@@ -34,6 +86,39 @@ def sitemap():
     return generate_sitemap(app)
 
 
+def probe_engine(engine):
+    """Pool counters and a SELECT 1 for one engine, on a connection of its own."""
+    pool = engine.pool
+    # Taken before the probe query checks out its own connection. QueuePool
+    # exposes these counters; SQLite's pools may not.
+    pool_stats = {
+        name: getattr(pool, name)() for name in ('size', 'checkedin', 'checkedout', 'overflow')
+        if hasattr(pool, name)
+    }
+    started = time.perf_counter()
+    try:
+        with engine.connect() as connection:
+            connection.execute(db.text('SELECT 1'))
+    except Exception as e:
+        return {'status': 'error', 'error': str(e), 'pool': pool_stats}
+    return {
+        'status': 'ok',
+        'latency_ms': round((time.perf_counter() - started) * 1000, 2),
+        'pool': pool_stats
+    }
+
+@app.route('/health/db', methods=['GET'])
+def health_db():
+    # The primary is probed through its engine: the session would send a
+    # GET's query to a replica. Replicas are reported on their own and do not
+    # change the status code.
+    report = probe_engine(db.engine)
+    replicas = {key: probe_engine(engine) for key, engine in db.engines.items() if key and key.startswith(REPLICA_BIND_PREFIX)}
+    if replicas:
+        report['replicas'] = replicas
+    return jsonify(report), 200 if report['status'] == 'ok' else 503
+
+
 @app.route('/users', methods=['POST'])  
 def create_new_user():  
     try: 
@@ -70,12 +155,17 @@ def create_new_user():
 @app.route('/users', methods=['GET'])
 def get_users():
     try:
-        users = User.query.all()
-        if not users:
+        include_favorites = 'favorites' in get_expand_arg()
+        query = User.query
+        if include_favorites:
+            query = query.options(*USER_FAVORITES_LOADS)
+        users, next_cursor = paginate_by_id(query, User)
+        if not users and request.args.get('after') is None:
             return jsonify({'message': 'No users found'}), 404
-        
-        response_body = [user.serialize() for user in users]
-        return jsonify(response_body), 200
+
+        return jsonify(page_response(users, next_cursor, include_favorites=include_favorites)), 200
+    except APIException:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     
@@ -83,9 +173,9 @@ def get_users():
 @app.route('/favorites', methods=['GET'])
 def get_favorites():
     try:
-        favorites = favorites.query.all()
-        
-        serialized_favorites = [favorito.serialize() for favorito in favorites]
+        all_favorites = favorites.query.options(*FAVORITE_LOADS).all()
+
+        serialized_favorites = [favorito.serialize() for favorito in all_favorites]
         
         return jsonify(serialized_favorites), 200
     except Exception as e:
@@ -103,69 +193,50 @@ def get_user_favorites():
         user = User.query.get(user_id)  
         if not user: 
             return jsonify({'message': 'User not found'}), 404  
-        favorites = user.favorites  
-        serialized_favorites = [favorito.serialize() for favorito in favorites]  
+        user_favorites = favorites.query.options(*FAVORITE_LOADS).filter_by(user_id=user.id).all()
+        serialized_favorites = [favorito.serialize() for favorito in user_favorites]
         return jsonify(serialized_favorites), 200  
     except Exception as e:  
         return jsonify({'error': str(e)}), 500  
 
-@app.route('/favorite/planet/<int:planet_id>', methods=['POST'])  
-def add_favorite_planet(planet_id): 
-    try:  
-        data = request.json  
-        if not data:  
-            return jsonify({'error': 'No data provided'}), 400  
 
-        user_id = data.get('user_id')  
-        if not user_id:  
-            return jsonify({'error': 'User ID is required'}), 400  
+# Statement builders shared with the async handlers in asgi.py.
 
-        user = User.query.get(user_id) 
-        if not user:  
-            return jsonify({'error': 'User not found'}), 404 
+def add_favorite_statement(user_id, kind, target_id, dialect=None):
+    # INSERT ... SELECT WHERE EXISTS(user) AND EXISTS(target) ON CONFLICT DO NOTHING:
+    # the common case is one statement, and only a miss pays for a lookup.
+    model, column = FAVORITE_TARGETS[kind]
+    source = select(literal(user_id), literal(target_id)).where(
+        exists().where(User.id == user_id),
+        exists().where(model.id == target_id)
+    )
+    return insert_ignoring_duplicates(favorites, dialect).from_select(['user_id', column], source)
 
-        planet = Planet.query.get(planet_id)
-        if not planet:
-            return jsonify({'error': 'Planet not found'}), 404  
-        new_favorite = favorites(user_id = user_id, planet_id = planet_id)
-        db.session.add(new_favorite)
-        db.session.commit()  
+def remove_favorite_statement(user_id, kind, target_id):
+    column = getattr(favorites, FAVORITE_TARGETS[kind][1])
+    return delete(favorites).where(favorites.user_id == user_id, column == target_id)
 
-        return jsonify({'message': 'Planet added to favorites'}), 201  
-    except Exception as e:  
-        return jsonify({'error': str(e)}), 500 
+def favorite_status_statement(user_id, kind, target_id):
+    """Only run on the failure path: why did the single-statement write not touch a row?"""
+    model = FAVORITE_TARGETS[kind][0]
+    return select(exists().where(User.id == user_id), exists().where(model.id == target_id))
 
-@app.route('/favorite/character/<int:character_id>', methods=['POST'])  
-def add_favorite_character(character_id): 
-    try:  
-        data = request.json  
-        if not data:  
-            return jsonify({'error': 'No data provided'}), 400  
-
-        user_id = data.get('user_id')  
-        if not user_id:  
-            return jsonify({'error': 'User ID is required'}), 400 
-
-        user = User.query.get(user_id) 
-        if not user: 
-            return jsonify({'error': 'User not found'}), 404  
+def favorite_miss_response(kind, user_exists, target_exists, removing):
+    if not user_exists:
+        return {'error': 'User not found'}, 404
+    if removing:
+        return {'error': 'Favorite not found'}, 404
+    if not target_exists:
+        return {'error': kind.capitalize() + ' not found'}, 404
+    return {'error': kind.capitalize() + ' is already in favorites'}, 409
 
-        character = Character.query.get(character_id) 
-        if not character: 
-            return jsonify({'error': 'character not found'}), 404 
 
-        new_favorite = favorites(user_id = user_id, character_id = character_id)
-        db.session.add(new_favorite)
-        db.session.commit()  
-
-        return jsonify({'message': 'character added to favorites'}), 201  
-    except Exception as e:  
-        return jsonify({'error': str(e)}), 500  
-
-
-@app.route('/favorite/planet/<int:planet_id>', methods=['DELETE'])
-def remove_favorite_planet(planet_id):
+@app.route('/favorite/<kind>/<int:target_id>', methods=['POST'])
+def add_favorite(kind, target_id):
     try:
+        if kind not in FAVORITE_TARGETS:
+            return jsonify({'error': 'Unknown favorite kind: ' + kind}), 404
+
         data = request.json
         if not data:
             return jsonify({'error': 'No data provided'}), 400
@@ -174,25 +245,30 @@ def remove_favorite_planet(planet_id):
         if not user_id:
             return jsonify({'error': 'User ID is required'}), 400
 
-        user = User.query.get(user_id)
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-
-        favorite = favorites.query.filter_by(user_id=user_id, planet_id=planet_id).first()
-        if not favorite:
-            return jsonify({'error': 'Favorite not found'}), 404
-
-        db.session.delete(favorite)
+        result = db.session.execute(add_favorite_statement(user_id, kind, target_id))
+        if result.rowcount:
+            db.session.execute(increment_favorite_counts([(kind, target_id)]))
         db.session.commit()
 
-        return jsonify({'message': 'Favorite planet removed successfully'}), 200
+        if result.rowcount == 0:
+            user_exists, target_exists = db.session.execute(favorite_status_statement(user_id, kind, target_id)).one()
+            body, status = favorite_miss_response(kind, user_exists, target_exists, removing=False)
+            return jsonify(body), status
+
+        return jsonify({'message': kind.capitalize() + ' added to favorites'}), 201
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': kind.capitalize() + ' is already in favorites'}), 409
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/favorite/character/<int:character_id>', methods=['DELETE'])
-def remove_favorite_character(character_id):
+@app.route('/favorite/<kind>/<int:target_id>', methods=['DELETE'])
+def remove_favorite(kind, target_id):
     try:
+        if kind not in FAVORITE_TARGETS:
+            return jsonify({'error': 'Unknown favorite kind: ' + kind}), 404
+
         data = request.json
         if not data:
             return jsonify({'error': 'No data provided'}), 400
@@ -201,32 +277,268 @@ def remove_favorite_character(character_id):
         if not user_id:
             return jsonify({'error': 'User ID is required'}), 400
 
-        user = User.query.get(user_id)
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-
-        favorite = favorites.query.filter_by(user_id=user_id, character_id=character_id).first()
-        if not favorite:
-            return jsonify({'error': 'Favorite not found'}), 404
-
-        db.session.delete(favorite)
+        deleted = db.session.execute(remove_favorite_statement(user_id, kind, target_id)).rowcount
+        if deleted:
+            db.session.execute(decrement_favorite_counts(kind, [target_id]))
         db.session.commit()
 
-        return jsonify({'message': 'Favorite character removed successfully'}), 200
+        if not deleted:
+            user_exists, target_exists = db.session.execute(favorite_status_statement(user_id, kind, target_id)).one()
+            body, status = favorite_miss_response(kind, user_exists, target_exists, removing=True)
+            return jsonify(body), status
+
+        return jsonify({'message': 'Favorite %s removed successfully' % kind}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+MAX_BULK_FAVORITES = 500
+
+def parse_bulk_favorites(data):
+    """Splits the request items into valid (kind, id) pairs grouped by kind, and per-item results for the rest."""
+    if not isinstance(data, dict) or not isinstance(data.get('favorites'), list):
+        raise APIException("'favorites' must be a list of {kind, id} objects", status_code=400)
+    items = data['favorites']
+    if len(items) > MAX_BULK_FAVORITES:
+        raise APIException('At most %d favorites per request' % MAX_BULK_FAVORITES, status_code=400)
+
+    results = []
+    ids_by_kind = {}
+    for item in items:
+        kind = item.get('kind') if isinstance(item, dict) else None
+        target_id = item.get('id') if isinstance(item, dict) else None
+        result = {'kind': kind, 'id': target_id}
+        results.append(result)
+        # Checked as a str first: a list or dict kind is unhashable.
+        if not isinstance(kind, str) or kind not in FAVORITE_TARGETS or not isinstance(target_id, int) or isinstance(target_id, bool):
+            result['status'] = 'invalid'
+            continue
+        ids_by_kind.setdefault(kind, set()).add(target_id)
+    return results, ids_by_kind
+
+def find_user_favorites(user_id, ids_by_kind):
+    """Returns {(kind, target_id): favorite id} for the given targets, in one query."""
+    columns = [getattr(favorites, FAVORITE_TARGETS[kind][1]) for kind in ids_by_kind]
+    conditions = [column.in_(ids_by_kind[kind]) for kind, column in zip(ids_by_kind, columns)]
+    if not conditions:
+        return {}
+    rows = db.session.query(favorites.id, *columns).filter(favorites.user_id == user_id, or_(*conditions)).all()
+    found = {}
+    for row in rows:
+        for kind, target_id in zip(ids_by_kind, row[1:]):
+            if target_id in ids_by_kind[kind]:
+                found[(kind, target_id)] = row[0]
+    return found
+
+def favorite_target(row):
+    """(kind, target_id) of a favorites row given as a mapping of its columns."""
+    for kind, (_, column) in FAVORITE_TARGETS.items():
+        if row[column] is not None:
+            return kind, row[column]
+
+def insert_favorites(rows):
+    """Inserts rows, skipping duplicates, and returns the ones actually inserted."""
+    columns = [column for _, column in FAVORITE_TARGETS.values()]
+    # Multi-row VALUES needs the same keys in every row.
+    for row in rows:
+        for column in columns:
+            row.setdefault(column, None)
+    statement = insert_ignoring_duplicates(favorites)
+    if db.session.get_bind().dialect.insert_returning:
+        # ON CONFLICT DO NOTHING only returns the rows it inserted.
+        returning = statement.values(rows).returning(*[favorites.__table__.c[column] for column in columns])
+        return [row._mapping for row in db.session.execute(returning)]
+    # MySQL's INSERT IGNORE cannot say which rows it skipped: one row per
+    # statement, told apart by its rowcount.
+    return [row for row in rows if db.session.execute(statement.values(row)).rowcount]
+
+def delete_favorites(found):
+    """Deletes the {(kind, target_id): favorite id} rows and returns the keys of those actually deleted."""
+    if not found:
+        return set()
+    table = favorites.__table__
+    if db.session.get_bind().dialect.delete_returning:
+        deleted = set(db.session.scalars(delete(table).where(table.c.id.in_(set(found.values()))).returning(table.c.id)))
+        return {key for key, favorite_id in found.items() if favorite_id in deleted}
+    # MySQL's DELETE has no RETURNING: one row per statement, told apart by
+    # its rowcount, as in insert_favorites().
+    return {key for key, favorite_id in found.items() if db.session.execute(delete(table).where(table.c.id == favorite_id)).rowcount}
+
+
+@app.route('/users/<int:user_id>/favorites/bulk', methods=['POST'])
+def add_favorites_bulk(user_id):
+    results, ids_by_kind = parse_bulk_favorites(request.json)
+    if not db.session.query(User.id).filter_by(id=user_id).first():
+        return jsonify({'error': 'User not found'}), 404
+
+    existing_targets = {}
+    for kind, ids in ids_by_kind.items():
+        model = FAVORITE_TARGETS[kind][0]
+        existing_targets[kind] = {row[0] for row in db.session.query(model.id).filter(model.id.in_(ids))}
+    already_favorite = find_user_favorites(user_id, ids_by_kind)
+
+    rows = []
+    for result in results:
+        if 'status' in result:
+            continue
+        key = (result['kind'], result['id'])
+        if result['id'] not in existing_targets[result['kind']]:
+            result['status'] = 'not_found'
+        elif key in already_favorite:
+            result['status'] = 'exists'
+        else:
+            result['status'] = 'added'
+            already_favorite[key] = None
+            rows.append({'user_id': user_id, FAVORITE_TARGETS[result['kind']][1]: result['id']})
+
+    if rows:
+        # A concurrent request may have added some of these since they were
+        # looked up; the insert skips those, so only the rows it really
+        # inserted count as added.
+        added = {favorite_target(row) for row in insert_favorites(rows)}
+        for result in results:
+            if result['status'] == 'added' and (result['kind'], result['id']) not in added:
+                result['status'] = 'exists'
+        if added:
+            db.session.execute(increment_favorite_counts(sorted(added)))
+    db.session.commit()
+    return jsonify({'results': results}), 200
+
+
+@app.route('/users/<int:user_id>/favorites/bulk', methods=['DELETE'])
+def remove_favorites_bulk(user_id):
+    results, ids_by_kind = parse_bulk_favorites(request.json)
+    if not db.session.query(User.id).filter_by(id=user_id).first():
+        return jsonify({'error': 'User not found'}), 404
+
+    # A concurrent request may have removed some of these since they were
+    # looked up; only the rows this DELETE removed count as removed.
+    removed = delete_favorites(find_user_favorites(user_id, ids_by_kind))
+    for result in results:
+        if 'status' not in result:
+            result['status'] = 'removed' if (result['kind'], result['id']) in removed else 'not_found'
+
+    removed_by_kind = {}
+    for kind, target_id in removed:
+        removed_by_kind.setdefault(kind, []).append(target_id)
+    for kind, target_ids in removed_by_kind.items():
+        db.session.execute(decrement_favorite_counts(kind, target_ids))
+    db.session.commit()
+    return jsonify({'results': results}), 200
+
+
+# check_changes() statuses -> the response status of a single-row write.
+CHANGE_ERROR_STATUS = {'invalid': 400, 'conflict': 409}
+
+def check_changes(model, changes_by_id):
+    """
+    Per-item errors, {id: (status, message)}, for parsed changes the database
+    would reject: a foreign key naming a missing row ('invalid'), or a unique
+    value another row or item already has ('conflict'). One IN query per
+    changed foreign key or unique column, however many items.
+    """
+    errors = {}
+    table = model.__table__
+    for column in table.columns:
+        if column.key not in model.editable_fields or not (column.foreign_keys or column.unique):
+            continue
+        values = {item_id: changes[column.key] for item_id, changes in changes_by_id.items() if changes.get(column.key) is not None}
+        if not values:
+            continue
+        if column.foreign_keys:
+            target = next(iter(column.foreign_keys)).column
+            found = set(db.session.scalars(select(target).where(target.in_(set(values.values())))))
+            for item_id, value in values.items():
+                if value not in found:
+                    errors.setdefault(item_id, ('invalid', "No %s with id %s for '%s'" % (target.table.name, value, column.key)))
+        else:
+            taken = dict(db.session.execute(select(column, table.c.id).where(column.in_(set(values.values())))).all())
+            claimed = {}
+            for item_id, value in values.items():
+                if taken.get(value, item_id) != item_id or claimed.setdefault(value, item_id) != item_id:
+                    errors.setdefault(item_id, ('conflict', "'%s' %s is already in use" % (column.key, value)))
+    return errors
+
+def raise_change_error(model, item_id, changes):
+    error = check_changes(model, {item_id: changes}).get(item_id)
+    if error:
+        raise APIException(error[1], status_code=CHANGE_ERROR_STATUS[error[0]])
+
+def create_row(resource, data):
+    """Inserts a row from a POST body, validated like an update, and returns it."""
+    model = CATALOG_MODELS[resource]
+    values = parse_changes(model, data)
+    for column in model.__table__.columns:
+        if column.key in model.editable_fields and not column.nullable and column.default is None and column.key not in values:
+            raise APIException("'%s' is required" % column.key, status_code=400)
+    raise_change_error(model, None, values)
+
+    row = model(**values)
+    db.session.add(row)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        # A concurrent write took a unique value since the check.
+        db.session.rollback()
+        raise APIException('The row conflicts with a concurrent change', status_code=409)
+    search.index_entity(resource, row)
+    db.session.commit()
+    return row
+
+def update_row(resource, item_id, changes):
+    """
+    Applies changes with a single UPDATE ... WHERE id = ? that also bumps the
+    row version. With If-Match the WHERE also requires the version from the
+    client's ETag, so a concurrent edit makes it match nothing and the request
+    fails with 412 instead of overwriting; no row is read or locked first.
+    Returns False when the row does not exist.
+    """
+    model = CATALOG_MODELS[resource]
+    table = model.__table__
+    raise_change_error(model, item_id, changes)
+    values = dict(changes)
+    for name in model.numeric_columns:
+        if name in values:
+            values[name + '_num'] = parse_number(values[name])
+    values['version'] = table.c.version + 1
+    statement = update(table).where(table.c.id == item_id).values(values)
+    versions = if_match_versions()
+    if versions is not None:
+        statement = statement.where(table.c.version.in_(versions))
+
+    try:
+        updated = db.session.execute(statement).rowcount
+    except IntegrityError:
+        db.session.rollback()
+        raise APIException('The changes conflict with a concurrent change', status_code=409)
+    if updated == 0:
+        row_exists = versions is not None and db.session.query(model.id).filter_by(id=item_id).first() is not None
+        db.session.rollback()
+        if row_exists:
+            raise APIException('The resource was modified since it was read (If-Match failed)', status_code=412)
+        return False
+    search.reindex_entities(resource, [item_id])
+    db.session.commit()
+    return True
+
+def detail_etag(model, item_id):
+    # The ETag a GET of this row now returns, so the client can chain writes.
+    state = db.session.execute(validator_statement(model, item_id=item_id)).one()
+    return validators(request.path + '?', state, versioned=True)[0]
+
+
 @app.route('/characters', methods=['GET'])
+@conditional_get(Character)
+@cache.cached
 def get_characters():
-    characters = Character.query.all()
-    serialized_characters = [character.serialize() for character in characters]
-    return jsonify(serialized_characters)
+    return jsonify(catalog_page(Character))
 
 
 @app.route('/character/<int:character_id>', methods=['GET'])  
+@conditional_get(Character, id_arg='character_id')
+@cache.cached
 def get_character(character_id):  
-    character = Character.query.get(character_id) 
+    character = Character.query.options(*CHARACTER_LOADS).get(character_id)
     if not character: 
         return jsonify({'error': 'Character not found'}), 404 
     return jsonify(character.serialize())  
@@ -239,33 +551,22 @@ def add_character():
     if not data: 
         return jsonify({'error': 'No data provided'}), 400  
 
-    character = Character() 
-    for key, value in data.items():  
-        if hasattr(character, key): 
-            setattr(character, key, value)  
-
-    db.session.add(character)  
-    db.session.commit() \
-
+    character = create_row('characters', data)
     return jsonify({'message': 'Character created successfully', 'character_id': character.id}), 201 
 
 
 @app.route('/character/<int:character_id>', methods=['PUT'])  
 def update_character(character_id):  
-    character = Character.query.get(character_id)
-    if not character: 
-        return jsonify({'error': 'Character not found'}), 404
-
     data = request.json  
     if not data:  
         return jsonify({'error': 'No data provided'}), 400 
 
-    for key, value in data.items():
-        if hasattr(character, key):
-            setattr(character, key, value) 
+    if not update_row('characters', character_id, parse_changes(Character, data)):
+        return jsonify({'error': 'Character not found'}), 404
 
-    db.session.commit()
-    return jsonify({'message': 'Character updated successfully'})
+    response = jsonify({'message': 'Character updated successfully'})
+    response.set_etag(detail_etag(Character, character_id))
+    return response
 
 
 @app.route('/character/<int:character_id>', methods=['DELETE']) 
@@ -275,24 +576,29 @@ def delete_character(character_id):
         return jsonify({'error': 'Character not found'}), 404  
 
     db.session.delete(character) 
+    search.remove_entity('characters', character_id)
+    db.session.execute(drop_favorite_counts('character', [character_id]))
     db.session.commit() 
     return jsonify({'message': 'Character deleted successfully'})
 
 
 
 @app.route('/planets', methods=['GET'])  
+@conditional_get(Planet)
+@cache.cached
 def get_planets(): 
-    planets = Planet.query.all()  
-    serialized_planets = [planet.serialize() for planet in planets] 
-    return jsonify(serialized_planets)  
+    return jsonify(catalog_page(Planet))
 
 
 @app.route('/planet/<int:planet_id>', methods=['GET']) 
+@conditional_get(Planet, id_arg='planet_id')
+@cache.cached
 def get_planet(planet_id):
+    include = get_include_arg(Planet)
     planet = Planet.query.get(planet_id) 
     if not planet: 
         return jsonify({'error': 'Planet not found'}), 404  
-    return jsonify(planet.serialize()) 
+    return jsonify({**planet.serialize(), **include_related(planet, include)})
 
 
 
@@ -302,33 +608,21 @@ def add_planet():
     if not data:  
         return jsonify({'error': 'No data provided'}), 400  
 
-    planet = Planet() 
-    for key, value in data.items(): 
-        if hasattr(planet, key):
-            setattr(planet, key, value) 
-
-    db.session.add(planet) 
-    db.session.commit()  
-
+    planet = create_row('planets', data)
     return jsonify({'message': 'Planet created successfully', 'planet_id': planet.id}), 201
 
 @app.route('/planet/<int:planet_id>', methods=['PUT'])
 def update_planet(planet_id):
-    planet = Planet.query.get(planet_id) 
-    if not planet: 
-        return jsonify({'error': 'Planet not found'}), 404 
-
     data = request.json 
     if not data:  
         return jsonify({'error': 'No data provided'}), 400  
 
-    for key, value in data.items():
-       
-        if hasattr(planet, key): 
-            setattr(planet, key, value)
+    if not update_row('planets', planet_id, parse_changes(Planet, data)):
+        return jsonify({'error': 'Planet not found'}), 404
 
-    db.session.commit()  
-    return jsonify({'message': 'Planet updated successfully'})  
+    response = jsonify({'message': 'Planet updated successfully'})
+    response.set_etag(detail_etag(Planet, planet_id))
+    return response
 
 
 @app.route('/planet/<int:planet_id>', methods=['DELETE'])
@@ -338,11 +632,309 @@ def delete_planet(planet_id):
         return jsonify({'error': 'Planet not found'}), 404 
 
     db.session.delete(planet)  
+    search.remove_entity('planets', planet_id)
+    db.session.execute(drop_favorite_counts('planet', [planet_id]))
     db.session.commit() 
     return jsonify({'message': 'Planet deleted successfully'})  
 
 
 
+@app.route('/starships', methods=['GET'])
+@conditional_get(Starship)
+@cache.cached
+def get_starships():
+    return jsonify(catalog_page(Starship))
+
+
+@app.route('/vehicles', methods=['GET'])
+@conditional_get(Vehicle)
+@cache.cached
+def get_vehicles():
+    return jsonify(catalog_page(Vehicle))
+
+
+@app.route('/species', methods=['GET'])
+@conditional_get(Species)
+@cache.cached
+def get_species():
+    return jsonify(catalog_page(Species))
+
+
+@app.route('/films', methods=['GET'])
+@conditional_get(Film)
+@cache.cached
+def get_films():
+    return jsonify(catalog_page(Film))
+
+
+@app.route('/film/<int:film_id>', methods=['GET'])
+@conditional_get(Film, id_arg='film_id')
+@cache.cached
+def get_film(film_id):
+    include = get_include_arg(Film)
+    film = Film.query.get(film_id)
+    if not film:
+        return jsonify({'error': 'Film not found'}), 404
+    return jsonify({**film.serialize(), **include_related(film, include)})
+
+
+MAX_BULK_EDITS = 1000
+
+def parse_bulk_updates(model, data):
+    """Per-item results and {id: parsed changes} for the valid items of a bulk PATCH body."""
+    if not isinstance(data, dict) or not isinstance(data.get('updates'), list):
+        raise APIException("'updates' must be a list of {id, changes} objects", status_code=400)
+    items = data['updates']
+    if len(items) > MAX_BULK_EDITS:
+        raise APIException('At most %d updates per request' % MAX_BULK_EDITS, status_code=400)
+
+    results = []
+    changes_by_id = {}
+    for item in items:
+        item_id = item.get('id') if isinstance(item, dict) else None
+        result = {'id': item_id}
+        results.append(result)
+        if not isinstance(item_id, int) or isinstance(item_id, bool):
+            result.update(status='invalid', error="'id' must be an integer")
+        elif item_id in changes_by_id:
+            result.update(status='invalid', error='Duplicate id')
+        else:
+            try:
+                changes_by_id[item_id] = parse_changes(model, item.get('changes'))
+            except APIException as e:
+                result.update(status='invalid', error=e.message)
+    return results, changes_by_id
+
+def parse_bulk_ids(data):
+    if not isinstance(data, dict) or not isinstance(data.get('ids'), list):
+        raise APIException("'ids' must be a list of integers", status_code=400)
+    if len(data['ids']) > MAX_BULK_EDITS:
+        raise APIException('At most %d ids per request' % MAX_BULK_EDITS, status_code=400)
+    results = []
+    ids = set()
+    for item_id in data['ids']:
+        result = {'id': item_id}
+        results.append(result)
+        if not isinstance(item_id, int) or isinstance(item_id, bool):
+            result['status'] = 'invalid'
+        else:
+            ids.add(item_id)
+    return results, ids
+
+def bulk_update(resource):
+    """
+    Applies a list of {id, changes} in one transaction: one SELECT for the
+    ids that exist, then one executemany UPDATE per distinct set of changed
+    columns. The numeric shadow columns are filled here since Core updates
+    skip the ORM events; edited is set by its column onupdate and version
+    is bumped in the same statement.
+    """
+    model = CATALOG_MODELS[resource]
+    results, changes_by_id = parse_bulk_updates(model, request.json)
+    existing = {row[0] for row in db.session.query(model.id).filter(model.id.in_(changes_by_id))} if changes_by_id else set()
+    errors = check_changes(model, {item_id: changes_by_id[item_id] for item_id in existing})
+    existing -= set(errors)
+
+    groups = {}
+    for item_id in existing:
+        changes = dict(changes_by_id[item_id])
+        for name in model.numeric_columns:
+            if name in changes:
+                changes[name + '_num'] = parse_number(changes[name])
+        params = {'v_' + name: value for name, value in changes.items()}
+        params['v_id'] = item_id
+        groups.setdefault(tuple(sorted(changes)), []).append(params)
+    table = model.__table__
+    for names, params in groups.items():
+        values = {name: bindparam('v_' + name) for name in names}
+        values['version'] = table.c.version + 1
+        statement = update(table).where(table.c.id == bindparam('v_id')).values(values)
+        try:
+            db.session.execute(statement, params)
+        except IntegrityError:
+            # A concurrent write took a unique value since the check.
+            db.session.rollback()
+            raise APIException('The updates conflict with a concurrent change', status_code=409)
+    if existing:
+        search.reindex_entities(resource, existing)
+    db.session.commit()
+
+    for result in results:
+        if 'status' in result:
+            continue
+        if result['id'] in errors:
+            status, message = errors[result['id']]
+            result.update(status=status, error=message)
+        else:
+            result['status'] = 'updated' if result['id'] in existing else 'not_found'
+    return {'results': results}
+
+def bulk_delete(resource):
+    """
+    Deletes a list of ids with one DELETE ... WHERE id IN. Rows pointing at
+    them are handled like the ORM does for a single delete: association rows
+    are removed and one-to-many foreign keys (favorites, homeworlds...) set to NULL.
+    """
+    model = CATALOG_MODELS[resource]
+    results, ids = parse_bulk_ids(request.json)
+    existing = {row[0] for row in db.session.query(model.id).filter(model.id.in_(ids))} if ids else set()
+
+    if existing:
+        for relationship in inspect(model).relationships:
+            if relationship.secondary is not None:
+                for parent_column, link_column in relationship.synchronize_pairs:
+                    db.session.execute(delete(relationship.secondary).where(link_column.in_(existing)))
+            elif relationship.direction is RelationshipDirection.ONETOMANY:
+                for parent_column, child_column in relationship.synchronize_pairs:
+                    values = {child_column.name: None}
+                    # The children changed: their ETags must stop matching, as after an ORM delete.
+                    if 'version' in child_column.table.c:
+                        values['version'] = child_column.table.c.version + 1
+                    db.session.execute(update(child_column.table).where(child_column.in_(existing)).values(values))
+        db.session.execute(delete(model.__table__).where(model.__table__.c.id.in_(existing)))
+        db.session.execute(drop_favorite_counts(FAVORITE_KINDS[model], existing))
+        search.remove_entities(resource, existing)
+    db.session.commit()
+
+    for result in results:
+        if 'status' not in result:
+            result['status'] = 'deleted' if result['id'] in existing else 'not_found'
+    return {'results': results}
+
+
+@app.route('/characters', methods=['PATCH'])
+def update_characters():
+    return jsonify(bulk_update('characters'))
+
+
+@app.route('/characters', methods=['DELETE'])
+def delete_characters():
+    return jsonify(bulk_delete('characters'))
+
+
+@app.route('/planets', methods=['PATCH'])
+def update_planets():
+    return jsonify(bulk_update('planets'))
+
+
+@app.route('/planets', methods=['DELETE'])
+def delete_planets():
+    return jsonify(bulk_delete('planets'))
+
+
+@app.route('/starships', methods=['PATCH'])
+def update_starships():
+    return jsonify(bulk_update('starships'))
+
+
+@app.route('/starships', methods=['DELETE'])
+def delete_starships():
+    return jsonify(bulk_delete('starships'))
+
+
+@app.route('/vehicles', methods=['PATCH'])
+def update_vehicles():
+    return jsonify(bulk_update('vehicles'))
+
+
+@app.route('/vehicles', methods=['DELETE'])
+def delete_vehicles():
+    return jsonify(bulk_delete('vehicles'))
+
+
+@app.route('/species', methods=['PATCH'])
+def update_species():
+    return jsonify(bulk_update('species'))
+
+
+@app.route('/species', methods=['DELETE'])
+def delete_species():
+    return jsonify(bulk_delete('species'))
+
+
+@app.route('/films', methods=['PATCH'])
+def update_films():
+    return jsonify(bulk_update('films'))
+
+
+@app.route('/films', methods=['DELETE'])
+def delete_films():
+    return jsonify(bulk_delete('films'))
+
+
+@app.route('/stats/favorites', methods=['GET'])
+def favorite_stats():
+    return jsonify({'results': stats.favorite_totals()})
+
+
+@app.route('/stats/favorites/top', methods=['GET'])
+def top_favorite_stats():
+    limit = get_int_arg('limit', 10, minimum=1, maximum=MAX_PAGE_SIZE)
+    return jsonify({'results': stats.top_favorites(request.args.get('kind'), limit)})
+
+
+@app.route('/stats/<resource>', methods=['GET'])
+def resource_stats(resource):
+    model = CATALOG_MODELS.get(resource)
+    if model is None:
+        return jsonify({'error': 'Unknown resource: ' + resource}), 404
+    group_by = request.args.get('group_by')
+    if not group_by:
+        raise APIException("'group_by' is required", status_code=400)
+    limit = get_int_arg('limit', DEFAULT_PAGE_SIZE, minimum=1, maximum=MAX_PAGE_SIZE)
+    return jsonify({'results': stats.group_counts(model, group_by, limit)})
+
+
+MAX_SEARCH_OFFSET = 1000
+
+@app.route('/search', methods=['GET'])
+def search_catalog():
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify({'error': "'q' is required"}), 400
+    limit = get_int_arg('limit', DEFAULT_PAGE_SIZE, minimum=1, maximum=MAX_PAGE_SIZE)
+    offset = get_int_arg('offset', 0, minimum=0, maximum=MAX_SEARCH_OFFSET)
+
+    rows = search.search(q, limit + 1, offset)
+    next_offset = offset + limit if len(rows) > limit and offset + limit <= MAX_SEARCH_OFFSET else None
+    results = [{'kind': row.kind, 'id': row.entity_id, 'name': row.name, 'score': row.score} for row in rows[:limit]]
+    return jsonify({'results': results, 'next': next_offset})
+
+
+EXPORT_BATCH_SIZE = 1000
+
+@app.route('/export/<resource>', methods=['GET'])
+def export_resource(resource):
+    model = CATALOG_MODELS.get(resource)
+    if model is None:
+        return jsonify({'error': 'Unknown resource: ' + resource}), 404
+
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'json'):
+        return jsonify({'error': "format must be 'ndjson' or 'json'"}), 400
+
+    # yield_per turns on a server-side cursor, so only one batch of rows (and
+    # its encoded text) is held in memory at a time, whatever the table size.
+    statement = model.serialize_query().order_by(model.id).statement
+    statement = statement.execution_options(yield_per=EXPORT_BATCH_SIZE)
+    dumps = app.json.dumps
+
+    def generate_ndjson():
+        for rows in db.session.execute(statement).partitions():
+            yield ''.join(dumps(row._asdict()) + '\n' for row in rows)
+
+    def generate_json():
+        separator = '['
+        for rows in db.session.execute(statement).partitions():
+            yield separator + ','.join(dumps(row._asdict()) for row in rows)
+            separator = ','
+        yield '[]' if separator == '[' else ']'
+
+    if export_format == 'json':
+        return Response(stream_with_context(generate_json()), mimetype='application/json')
+    return Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+
+
 
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
@@ -0,0 +1,283 @@
+"""
+ASGI entry point: `uvicorn asgi:application --app-dir src` (or gunicorn with uvicorn workers).
+Needs the Pipfile's async-drivers group: `pipenv install --categories "packages async-drivers"`.
+
+Catalog reads and favorite writes run as async handlers over an async
+SQLAlchemy engine, so a worker keeps serving other requests while one waits
+on the database. Every other route, and catalog reads that use options only
+the Flask app implements (filters, sorting, fields...), are passed through
+to the Flask app unchanged, so responses match the WSGI deployment.
+Catalog reads are routed to the replicas like the Flask app's (see replicas.py).
+"""
+import contextlib
+import itertools
+import json
+import time
+from a2wsgi import WSGIMiddleware
+from sqlalchemy import bindparam
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.exc import IntegrityError
+from starlette.applications import Starlette
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response
+from starlette.routing import Match, Route
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import http_date, parse_date, parse_etags
+from app import app as flask_app, add_favorite_statement, remove_favorite_statement, favorite_status_statement, favorite_miss_response
+from metrics import request_sql
+from profiler import TRACE_ARG, TRACE_HEADER
+from replicas import REPLICA_BIND_PREFIX, READ_PRIMARY_COOKIE, sticky_seconds
+from models import FAVORITE_TARGETS, CATALOG_MODELS, increment_favorite_counts, decrement_favorite_counts
+from utils import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, validator_statement, validators
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+    'mysql': 'mysql+aiomysql'
+}
+
+DETAIL_RESOURCES = {'character': 'characters', 'planet': 'planets'}
+ASYNC_LIST_ARGS = {'limit', 'after'}
+# Favorite writes pin the client to the primary as the Flask app does (see replicas.py).
+STICKY_SECONDS = sticky_seconds() if any(key.startswith(REPLICA_BIND_PREFIX) for key in flask_app.config['SQLALCHEMY_BINDS']) else None
+
+def create_engine_for(url, **overrides):
+    url = make_url(url)
+    options = {key: value for key, value in flask_app.config['SQLALCHEMY_ENGINE_OPTIONS'].items() if key != 'connect_args'}
+    options.update(overrides)
+    if url.get_backend_name() == 'postgresql' and 'connect_args' in flask_app.config['SQLALCHEMY_ENGINE_OPTIONS']:
+        timeout = flask_app.config['SQLALCHEMY_ENGINE_OPTIONS']['connect_args']['options'].split('=')[-1]
+        options['connect_args'] = {'server_settings': {'statement_timeout': timeout}}
+    return create_async_engine(url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()]), **options)
+
+engine = create_engine_for(flask_app.config['SQLALCHEMY_DATABASE_URI'])
+# One async engine per replica bind, with the bind's isolation level.
+replica_engines = [
+    create_engine_for(options['url'], **{key: value for key, value in options.items() if key == 'isolation_level'})
+    for key, options in sorted(flask_app.config['SQLALCHEMY_BINDS'].items()) if key.startswith(REPLICA_BIND_PREFIX)
+]
+replica_cycle = itertools.cycle(replica_engines)
+
+# Core statements are built once from the same projections the Flask views use.
+with flask_app.app_context():
+    CATALOG_STATEMENTS = {name: model.serialize_query().statement for name, model in CATALOG_MODELS.items()}
+    # The same validators as utils.conditional_get; detail requests handled
+    # here have no query string, so no ?include= tables.
+    VALIDATOR_STATEMENTS = {name: validator_statement(model, tables=model.projection_tables) for name, model in CATALOG_MODELS.items()}
+    VALIDATOR_STATEMENTS.update({
+        kind: validator_statement(CATALOG_MODELS[resource], item_id=bindparam('item_id')) for kind, resource in DETAIL_RESOURCES.items()
+    })
+
+def json_response(body, status_code=200, headers=None):
+    return Response(flask_app.json.dumps(body), status_code=status_code, headers=headers, media_type='application/json')
+
+def full_path(request):
+    # Same string as Flask's request.full_path, which the ETag is derived from.
+    return request.url.path + '?' + request.scope['query_string'].decode('latin-1')
+
+def read_engine(request):
+    # Same choice as replicas.choose_replica: clients that just wrote, or that
+    # ask for it, read from the primary.
+    if not replica_engines or request.cookies.get(READ_PRIMARY_COOKIE) or request.headers.get('x-read-primary'):
+        return engine
+    return next(replica_cycle)
+
+def int_arg(request, name, default=None, minimum=0, maximum=None):
+    value = request.query_params.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError("'%s' must be an integer" % name)
+    if value < minimum:
+        raise ValueError("'%s' must be at least %d" % (name, minimum))
+    return min(value, maximum) if maximum is not None else value
+
+async def conditional(request, connection, validated, item_id=None):
+    """Returns (304 response or None, validator headers), like utils.conditional_get."""
+    params = {'item_id': item_id} if item_id is not None else {}
+    state = (await connection.execute(VALIDATOR_STATEMENTS[validated], params)).first()
+    if state is None:
+        return None, {}
+    etag, last_modified = validators(full_path(request), state, versioned=item_id is not None)
+    headers = {'ETag': '"%s"' % etag}
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
+    if_none_match = request.headers.get('if-none-match')
+    if_modified_since = parse_date(request.headers.get('if-modified-since'))
+    if if_none_match:
+        not_modified = parse_etags(if_none_match).contains(etag)
+    else:
+        not_modified = last_modified is not None and if_modified_since is not None and last_modified <= if_modified_since
+    return (Response(status_code=304, headers=headers) if not_modified else None), headers
+
+async def list_resource(request):
+    resource = request.path_params['resource']
+    model = CATALOG_MODELS[resource]
+    try:
+        limit = int_arg(request, 'limit', DEFAULT_PAGE_SIZE, minimum=1, maximum=MAX_PAGE_SIZE)
+        after = int_arg(request, 'after')
+    except ValueError as e:
+        return json_response({'message': str(e)}, 400)
+
+    async with read_engine(request).connect() as connection:
+        not_modified, headers = await conditional(request, connection, resource)
+        if not_modified:
+            return not_modified
+        statement = CATALOG_STATEMENTS[resource]
+        if after is not None:
+            statement = statement.where(model.id > after)
+        rows = (await connection.execute(statement.order_by(model.id).limit(limit + 1))).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1].id
+    return json_response({'results': [row._asdict() for row in rows], 'next': next_cursor}, headers=headers)
+
+async def get_resource(request):
+    kind = request.path_params['kind']
+    resource = DETAIL_RESOURCES[kind]
+    model = CATALOG_MODELS[resource]
+    async with read_engine(request).connect() as connection:
+        not_modified, headers = await conditional(request, connection, kind, request.path_params['id'])
+        if not_modified:
+            return not_modified
+        row = (await connection.execute(CATALOG_STATEMENTS[resource].where(model.id == request.path_params['id']))).first()
+    if row is None:
+        return json_response({'error': kind.capitalize() + ' not found'}, 404)
+    return json_response(row._asdict(), headers=headers)
+
+async def read_user_id(request):
+    try:
+        data = json.loads(await request.body() or 'null')
+    except ValueError:
+        data = None
+    if not data:
+        return None, json_response({'error': 'No data provided'}, 400)
+    if not data.get('user_id'):
+        return None, json_response({'error': 'User ID is required'}, 400)
+    return data['user_id'], None
+
+async def favorite(request):
+    # Errors are answered like the Flask views do, as JSON.
+    kind = request.path_params['kind']
+    try:
+        response = await write_favorite(request, kind, request.path_params['id'])
+    except IntegrityError as e:
+        if request.method == 'DELETE':
+            return json_response({'error': str(e)}, 500)
+        return json_response({'error': kind.capitalize() + ' is already in favorites'}, 409)
+    except Exception as e:
+        return json_response({'error': str(e)}, 500)
+    if STICKY_SECONDS is not None and response.status_code < 400:
+        response.set_cookie(READ_PRIMARY_COOKIE, '1', max_age=STICKY_SECONDS, httponly=True, samesite=None)
+    return response
+
+async def write_favorite(request, kind, target_id):
+    if kind not in FAVORITE_TARGETS:
+        return json_response({'error': 'Unknown favorite kind: ' + kind}, 404)
+    user_id, error = await read_user_id(request)
+    if error:
+        return error
+
+    removing = request.method == 'DELETE'
+    async with engine.begin() as connection:
+        if removing:
+            result = await connection.execute(remove_favorite_statement(user_id, kind, target_id))
+            if result.rowcount:
+                await connection.execute(decrement_favorite_counts(kind, [target_id]))
+        else:
+            result = await connection.execute(add_favorite_statement(user_id, kind, target_id, engine.dialect.name))
+            if result.rowcount:
+                await connection.execute(increment_favorite_counts([(kind, target_id)], engine.dialect.name))
+    if result.rowcount == 0:
+        async with engine.connect() as connection:
+            user_exists, target_exists = (await connection.execute(favorite_status_statement(user_id, kind, target_id))).one()
+        body, status = favorite_miss_response(kind, user_exists, target_exists, removing)
+        return json_response(body, status)
+    if removing:
+        return json_response({'message': 'Favorite %s removed successfully' % kind}, 200)
+    return json_response({'message': kind.capitalize() + ' added to favorites'}, 201)
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    yield
+    await engine.dispose()
+    for replica in replica_engines:
+        await replica.dispose()
+
+async_app = Starlette(routes=[
+    Route('/{resource:str}', list_resource, methods=['GET']),
+    Route('/{kind:str}/{id:int}', get_resource, methods=['GET']),
+    Route('/favorite/{kind:str}/{id:int}', favorite, methods=['POST', 'DELETE']),
+], lifespan=lifespan)
+# The CORS headers flask_cors adds with CORS(app) to cross-origin requests:
+# the request's Origin echoed back, with Vary: Origin. Preflight OPTIONS
+# requests have no async route and go to Flask.
+cors_app = CORSMiddleware(async_app, allow_origin_regex='.*', allow_methods=['*'], allow_headers=['*'])
+wsgi_app = WSGIMiddleware(flask_app)
+
+observe = flask_app.extensions.get('metrics')
+url_adapter = flask_app.url_map.bind('localhost')
+
+def route_label(scope):
+    # The Flask rule the request matches, so both apps report the same routes.
+    try:
+        rule, _ = url_adapter.match(scope['path'], method=scope['method'], return_rule=True)
+        return rule.rule
+    except HTTPException:
+        return '<unmatched>'
+
+async def observed(scope, receive, send):
+    """Runs an async request, recording it in the Flask app's metrics (see metrics.py)."""
+    started = time.perf_counter()
+    sql = request_sql.set([0, 0.0])
+    response = {'status': 500, 'size': None}
+
+    async def capture(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+            for name, value in message['headers']:
+                if name == b'content-length':
+                    response['size'] = int(value)
+        await send(message)
+
+    try:
+        await cors_app(scope, receive, capture)
+    finally:
+        count, seconds = request_sql.get()
+        request_sql.reset(sql)
+        observe(scope['method'], route_label(scope), response['status'], time.perf_counter() - started,
+                count, seconds, response['size'])
+
+def handled_async(scope):
+    """True when the request has an async handler that produces the same response as Flask."""
+    # SQL traces (profiler.py) are only produced by the Flask app.
+    if any(name.decode('latin-1').lower() == TRACE_HEADER.lower() for name, _ in scope['headers']):
+        return False
+    query = scope['query_string'].decode('latin-1')
+    keys = {part.split('=', 1)[0] for part in query.split('&') if part}
+    if TRACE_ARG in keys:
+        return False
+    for route in async_app.routes:
+        match, child_scope = route.matches(scope)
+        if match != Match.FULL:
+            continue
+        params = child_scope['path_params']
+        if route.endpoint is list_resource:
+            return params['resource'] in CATALOG_MODELS and keys <= ASYNC_LIST_ARGS
+        if route.endpoint is get_resource:
+            return params['kind'] in DETAIL_RESOURCES and not scope['query_string']
+        return True
+    return False
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await async_app(scope, receive, send)
+    elif scope['type'] == 'http' and handled_async(scope):
+        await (observed if observe else cors_app)(scope, receive, send)
+    else:
+        await wsgi_app(scope, receive, send)
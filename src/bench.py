@@ -0,0 +1,463 @@
+"""
+Benchmarks every route against synthetic SWAPI data in a throwaway SQLite file.
+
+    pipenv run bench --sizes 10000,100000 --output bench-baseline.json
+    pipenv run bench --sizes 10000 --compare bench-baseline.json
+    pipenv run bench --sizes 10000 --load --concurrency 200 --workers 2
+
+For each size the database is rebuilt with that many characters and
+favorites (planets, users and the smaller catalogs scale with it), then each
+case below runs through the Flask test client, followed by the two ways of
+encoding 10k characters (ORM + serialize() + jsonify, projection + orjson).
+Reported per case: median and p95 latency, SQL statements per request and
+peak Python memory. --compare
+exits non-zero when a case got slower than --threshold times its baseline
+median or issues more statements than before.
+
+--load instead starts the WSGI deployment (gunicorn wsgi, as in the
+Procfile) and the ASGI one (uvicorn asgi:application) on the same database
+and drives each with --concurrency clients for --duration seconds, mixing
+catalog reads, detail reads and favorite writes. Reported per server:
+requests per second, median/p95/p99 latency and failed requests.
+"""
+import os
+import sys
+import tempfile
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATABASE_PATH = os.path.join(tempfile.gettempdir(), 'swapi-bench.db')
+# Must be set before the app is imported: it reads its configuration at import.
+os.environ['DATABASE_URL'] = 'sqlite:///' + DATABASE_PATH
+os.environ['CACHE_ENABLED'] = '0'
+
+import asyncio
+import json
+import platform
+import random
+import socket
+import sqlite3
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, date
+import click
+import httpx
+import sqlalchemy
+from sqlalchemy import event
+from flask.json.provider import DefaultJSONProvider
+from app import app, CHARACTER_LOADS
+import search
+import stats
+from models import db, parse_number, User, Film, Starship, Vehicle, Species, Planet, Character, favorites, films_planets
+
+INSERT_BATCH_SIZE = 5000
+SERIALIZATION_ROWS = 10000
+# Command lines serving the app on a port with a number of worker processes.
+LOAD_SERVERS = {
+    'wsgi': lambda port, workers: [sys.executable, '-m', 'gunicorn', 'wsgi', '--chdir', SOURCE_DIR,
+                                   '--workers', str(workers), '--bind', '127.0.0.1:%d' % port],
+    'asgi': lambda port, workers: [sys.executable, '-m', 'uvicorn', 'asgi:application', '--app-dir', SOURCE_DIR,
+                                   '--workers', str(workers), '--port', str(port), '--log-level', 'warning'],
+}
+CLIMATES = ('arid', 'temperate', 'frozen', 'murky', 'tropical')
+GENDERS = ('male', 'female', 'n/a')
+
+def scaled_counts(size):
+    return {
+        'characters': size,
+        'favorites': size,
+        'planets': max(size // 10, 10),
+        'users': max(size // 100, 10),
+        'starships': max(size // 100, 10),
+        'vehicles': max(size // 100, 10),
+        'species': max(size // 100, 10),
+        'films': 6,
+    }
+
+def insert_rows(table, rows):
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        db.session.execute(table.insert(), rows[start:start + INSERT_BATCH_SIZE])
+
+def with_numbers(model, row):
+    # Core inserts skip the ORM events that fill the numeric shadow columns.
+    for name in model.numeric_columns:
+        row[name + '_num'] = parse_number(row.get(name))
+    return row
+
+def build_database(size, seed=0):
+    """Recreates the benchmark database with size characters and favorites."""
+    counts = scaled_counts(size)
+    rng = random.Random(seed)
+    now = datetime(2024, 1, 1)
+
+    db.session.remove()
+    db.engine.dispose()
+    if os.path.exists(DATABASE_PATH):
+        os.remove(DATABASE_PATH)
+    # Also creates search_index (see search.create_index_table).
+    db.create_all()
+
+    insert_rows(Film.__table__, [
+        {'title': 'Film %d' % i, 'episode_id': i, 'director': 'Director %d' % (i % 3), 'opening_crawl': 'A long time ago %d' % i,
+         'release_date': date(1977 + i * 3, 5, 25), 'created': now, 'edited': now, 'url': 'films/%d' % i}
+        for i in range(1, counts['films'] + 1)
+    ])
+    insert_rows(Planet.__table__, [with_numbers(Planet, {
+        'name': 'Planet %d' % i, 'climate': rng.choice(CLIMATES), 'terrain': 'terrain %d' % (i % 7),
+        'population': str(rng.randint(0, 10 ** 9)) if i % 5 else 'unknown', 'diameter': str(rng.randint(1000, 20000)),
+        'created': now, 'edited': now, 'url': 'planets/%d' % i
+    }) for i in range(1, counts['planets'] + 1)])
+    insert_rows(films_planets, [
+        {'film_id': film_id, 'planet_id': planet_id}
+        for planet_id in range(1, counts['planets'] + 1)
+        for film_id in rng.sample(range(1, counts['films'] + 1), 2)
+    ])
+    insert_rows(Character.__table__, [with_numbers(Character, {
+        'name': 'Character %d' % i, 'gender': rng.choice(GENDERS), 'height': str(rng.randint(60, 250)),
+        'mass': str(rng.randint(20, 200)) if i % 4 else 'unknown', 'birth_year': '%dBBY' % rng.randint(1, 900),
+        'homeworld_id': rng.randint(1, counts['planets']), 'film_id': rng.randint(1, counts['films']),
+        'created': now, 'edited': now, 'url': 'people/%d' % i
+    }) for i in range(1, counts['characters'] + 1)])
+    insert_rows(Starship.__table__, [with_numbers(Starship, {
+        'name': 'Starship %d' % i, 'model': 'Model %d' % i, 'cost_in_credits': '{:,}'.format(rng.randint(10 ** 4, 10 ** 8)),
+        'MGLT': str(rng.randint(10, 120)), 'created': now, 'edited': now, 'url': 'starships/%d' % i
+    }) for i in range(1, counts['starships'] + 1)])
+    insert_rows(Vehicle.__table__, [with_numbers(Vehicle, {
+        'name': 'Vehicle %d' % i, 'model': 'Model %d' % i, 'passengers': str(rng.randint(0, 20)),
+        'created': now, 'edited': now, 'url': 'vehicles/%d' % i
+    }) for i in range(1, counts['vehicles'] + 1)])
+    insert_rows(Species.__table__, [with_numbers(Species, {
+        'name': 'Species %d' % i, 'language': 'Language %d' % (i % 20), 'average_height': str(rng.randint(50, 300)),
+        'homeworld_id': rng.randint(1, counts['planets']), 'created': now, 'edited': now, 'url': 'species/%d' % i
+    }) for i in range(1, counts['species'] + 1)])
+    insert_rows(User.__table__, [
+        {'email': 'user%d@example.com' % i, 'password': 'secret', 'is_active': True, 'username': 'user%d' % i,
+         'name': 'User', 'last_name': str(i)}
+        for i in range(1, counts['users'] + 1)
+    ])
+    # Two thirds characters, one third planets; (user, target) pairs stay unique.
+    users = counts['users']
+    character_favorites = counts['favorites'] * 2 // 3
+    insert_rows(favorites.__table__, [
+        {'user_id': i % users + 1, 'character_id': i // users + 1} for i in range(character_favorites)
+    ])
+    insert_rows(favorites.__table__, [
+        {'user_id': i % users + 1, 'planet_id': i // users % counts['planets'] + 1}
+        for i in range(counts['favorites'] - character_favorites)
+    ])
+
+    search.reindex_all()
+    stats.rebuild_favorite_counts()
+    db.session.commit()
+    db.session.execute(db.text('ANALYZE'))
+    return counts
+
+def benchmark_cases(counts, repeat):
+    """
+    (name, method, request(run) -> (path, json body[, headers])) for each route;
+    ids sit mid-table. Reads come first, then writes that leave the table
+    sizes as they were: rows created by the POST cases are deleted again by
+    the DELETE ones.
+    """
+    middle_character = counts['characters'] // 2
+    middle_planet = counts['planets'] // 2
+    user_id = counts['users'] // 2
+    # Writes use a fresh target on every run, from the top of the planet ids
+    # where the generated favorites never reach, so each run does real work.
+    top_planet = counts['planets']
+    bulk_top = top_planet - repeat - 1
+
+    # Generated character favorites cover every user for the lowest
+    # character ids; removing and re-adding those is a lookup among all
+    # size favorites (e.g. 1M with --sizes 1000000) on the unique index.
+    favorited_characters = max(counts['favorites'] * 2 // 3 // counts['users'], 1)
+
+    def held_favorite(run):
+        return '/favorite/character/%d' % (run % favorited_characters + 1), {'user_id': user_id}
+
+    def bulk_body(run):
+        return {'favorites': [{'kind': 'planet', 'id': bulk_top - run * 20 - i} for i in range(20)]}
+
+    def get(path):
+        return lambda run: (path, None)
+
+    # ETags taken before any write runs, for the revalidation cases.
+    client = app.test_client()
+
+    def revalidate(path):
+        etag = client.get(path).headers['ETag']
+        return lambda run: (path, None, {'If-None-Match': etag})
+
+    # New rows get the ids after the generated ones, in order.
+    new_character = counts['characters'] + 1
+    new_planet = counts['planets'] + 1
+    # Bulk deletes take generated characters from the top, which no
+    # generated favorite points at.
+    bulk_delete_top = counts['characters'] - repeat - 1
+
+    def bulk_update_body(run):
+        return {'updates': [{'id': middle_character + i, 'changes': {'height': str(100 + run)}} for i in range(50)]}
+
+    def bulk_delete_body(run):
+        return {'ids': [bulk_delete_top - run * 20 - i for i in range(20)]}
+
+    return [
+        ('characters list', 'GET', get('/characters')),
+        ('characters deep page', 'GET', get('/characters?after=%d' % middle_character)),
+        ('characters filter', 'GET', get('/characters?filter[gender]=female&filter[height][gte]=180')),
+        ('characters sort', 'GET', get('/characters?sort=-height&fields=name,height')),
+        ('character detail', 'GET', get('/character/%d' % middle_character)),
+        ('characters not modified', 'GET', revalidate('/characters')),
+        ('character not modified', 'GET', revalidate('/character/%d' % middle_character)),
+        ('planets list', 'GET', get('/planets')),
+        ('planets sort numeric', 'GET', get('/planets?sort=population')),
+        ('planet detail', 'GET', get('/planet/%d' % middle_planet)),
+        ('starships list', 'GET', get('/starships')),
+        ('vehicles list', 'GET', get('/vehicles')),
+        ('species list', 'GET', get('/species')),
+        ('films list', 'GET', get('/films')),
+        ('film include', 'GET', get('/film/1?include=characters,planets')),
+        ('search', 'GET', get('/search?q=character%%20%d' % middle_character)),
+        ('users list', 'GET', get('/users')),
+        ('users expand favorites', 'GET', get('/users?expand=favorites')),
+        ('user favorites', 'GET', get('/users/favorites?user_id=%d' % user_id)),
+        ('all favorites', 'GET', get('/favorites')),
+        ('health db', 'GET', get('/health/db')),
+        ('favorite add', 'POST', lambda run: ('/favorite/planet/%d' % (top_planet - run), {'user_id': user_id})),
+        ('favorite remove', 'DELETE', lambda run: ('/favorite/planet/%d' % (top_planet - run), {'user_id': user_id})),
+        ('favorite remove held', 'DELETE', held_favorite),
+        ('favorite add back', 'POST', held_favorite),
+        ('bulk favorites add', 'POST', lambda run: ('/users/%d/favorites/bulk' % user_id, bulk_body(run))),
+        ('bulk favorites remove', 'DELETE', lambda run: ('/users/%d/favorites/bulk' % user_id, bulk_body(run))),
+        ('character create', 'POST', lambda run: ('/characters', {'name': 'New %d' % run, 'height': '180', 'homeworld_id': middle_planet})),
+        ('character update', 'PUT', lambda run: ('/character/%d' % middle_character, {'height': str(100 + run)})),
+        ('character delete', 'DELETE', lambda run: ('/character/%d' % (new_character + run), None)),
+        ('planet create', 'POST', lambda run: ('/planets', {'name': 'New %d' % run, 'population': '1000'})),
+        ('planet update', 'PUT', lambda run: ('/planet/%d' % middle_planet, {'population': str(1000 + run)})),
+        ('planet delete', 'DELETE', lambda run: ('/planet/%d' % (new_planet + run), None)),
+        ('characters bulk update', 'PATCH', lambda run: ('/characters', bulk_update_body(run))),
+        ('characters bulk delete', 'DELETE', lambda run: ('/characters', bulk_delete_body(run))),
+        ('user create', 'POST', lambda run: ('/users', {
+            'email': 'new%d@example.com' % run, 'password': 'secret', 'username': 'new%d' % run, 'name': 'New', 'last_name': str(run)
+        })),
+        ('export characters', 'GET', get('/export/characters')),
+        ('stats group by', 'GET', get('/stats/characters?group_by=homeworld')),
+        ('stats top favorites', 'GET', get('/stats/favorites/top?kind=character')),
+    ]
+
+def load_mix(counts):
+    """Request makers for the load test, picked uniformly: rng -> (method, path, json body)."""
+    characters, planets, users = counts['characters'], counts['planets'], counts['users']
+    return [
+        lambda rng: ('GET', '/characters', None),
+        lambda rng: ('GET', '/characters?after=%d' % rng.randint(1, characters), None),
+        lambda rng: ('GET', '/character/%d' % rng.randint(1, characters), None),
+        lambda rng: ('GET', '/planets', None),
+        lambda rng: ('GET', '/planet/%d' % rng.randint(1, planets), None),
+        lambda rng: (rng.choice(('POST', 'DELETE')), '/favorite/planet/%d' % rng.randint(1, planets), {'user_id': rng.randint(1, users)}),
+    ]
+
+async def drive(base_url, mix, concurrency, duration):
+    """Runs concurrency clients back to back for duration seconds; returns (latencies, failures)."""
+    timings = []
+    failures = 0
+    deadline = time.perf_counter() + duration
+
+    async def client_loop(client, rng):
+        nonlocal failures
+        while time.perf_counter() < deadline:
+            method, path, body = rng.choice(mix)(rng)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body)
+                failures += response.status_code >= 500
+            except httpx.HTTPError:
+                failures += 1
+            timings.append(time.perf_counter() - started)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        await asyncio.gather(*(client_loop(client, random.Random(seed)) for seed in range(concurrency)))
+    return timings, failures
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def load_test(server, counts, concurrency, duration, workers):
+    """Serves the benchmark database with one of LOAD_SERVERS and measures it under concurrent load."""
+    port = free_port()
+    base_url = 'http://127.0.0.1:%d' % port
+    process = subprocess.Popen(LOAD_SERVERS[server](port, workers), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        started = time.perf_counter()
+        while True:
+            try:
+                if httpx.get(base_url + '/health/db').status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            if process.poll() is not None or time.perf_counter() - started > 30:
+                raise click.ClickException('%s server did not start' % server)
+            time.sleep(0.2)
+        timings, failures = asyncio.run(drive(base_url, load_mix(counts), concurrency, duration))
+    finally:
+        process.terminate()
+        process.wait()
+
+    timings.sort()
+    return {
+        'requests': len(timings),
+        'requests_per_s': round(len(timings) / duration, 1),
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'p95_ms': round(timings[int(len(timings) * 0.95)] * 1000, 3),
+        'p99_ms': round(timings[int(len(timings) * 0.99)] * 1000, 3),
+        'failures': failures,
+    }
+
+def serialization_cases(counts):
+    """
+    (name, send(run) -> status) for the two ways the first SERIALIZATION_ROWS
+    characters can be encoded, outside any route: ORM objects through
+    serialize() and the stdlib encoder behind jsonify, and the
+    serialize_query() projection through the app's orjson provider.
+    """
+    rows = min(SERIALIZATION_ROWS, counts['characters'])
+    stdlib_json = DefaultJSONProvider(app)
+
+    def orm_jsonify(run):
+        characters = Character.query.options(*CHARACTER_LOADS).order_by(Character.id).limit(rows).all()
+        response = stdlib_json.response([character.serialize() for character in characters])
+        response.get_data()
+        # Start the next run from an empty identity map.
+        db.session.remove()
+        return response.status_code
+
+    def projection_orjson(run):
+        result = Character.serialize_query().order_by(Character.id).limit(rows).all()
+        response = app.json.response([row._asdict() for row in result])
+        response.get_data()
+        return response.status_code
+
+    return [
+        ('serialize orm + jsonify', orm_jsonify),
+        ('serialize projection + orjson', projection_orjson),
+    ]
+
+def route_sender(client, method, make_request):
+    def send(run):
+        path, body, *headers = make_request(run)
+        response = client.open(path, method=method, json=body, headers=headers[0] if headers else None)
+        response.get_data()
+        if response.status_code >= 500:
+            raise click.ClickException('%s %s returned %d' % (method, path, response.status_code))
+        return response.status_code
+    return send
+
+def measure(send, repeat):
+    """Times repeat calls of send(run), then replays one under tracemalloc for its peak memory."""
+    statements = []
+
+    def count_statement(*args):
+        statements[-1] += 1
+
+    event.listen(db.engine, 'after_cursor_execute', count_statement)
+    timings = []
+    try:
+        for run in range(repeat):
+            statements.append(0)
+            started = time.perf_counter()
+            status = send(run)
+            timings.append(time.perf_counter() - started)
+    finally:
+        event.remove(db.engine, 'after_cursor_execute', count_statement)
+    # Tracing allocations slows everything down, so it stays out of the timed runs.
+    tracemalloc.start()
+    send(repeat)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000, 3),
+        'statements': max(statements),
+        'peak_kb': round(peak / 1024, 1),
+        'status': status,
+    }
+
+def compare(results, baseline, threshold):
+    """Prints the cases that regressed against baseline and returns how many did."""
+    regressions = 0
+    for size, cases in results.items():
+        for name, result in cases.items():
+            before = baseline.get('results', {}).get(size, {}).get(name)
+            # Load results have no statement counts and are compared by eye.
+            if before is None or 'statements' not in result:
+                continue
+            slower = result['median_ms'] > before['median_ms'] * threshold
+            chattier = result['statements'] > before['statements']
+            if slower or chattier:
+                regressions += 1
+                click.echo('REGRESSION %s @ %s: %.2f ms (was %.2f), %d statements (was %d)' % (
+                    name, size, result['median_ms'], before['median_ms'], result['statements'], before['statements']))
+    return regressions
+
+@click.command()
+@click.option('--sizes', default='10000', show_default=True, help='Comma separated character counts, e.g. 10000,100000,1000000.')
+@click.option('--repeat', default=20, show_default=True, help='Requests per case.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write the results as a baseline JSON file.')
+@click.option('--compare', 'baseline_path', type=click.Path(exists=True, dir_okay=False), help='Baseline JSON to compare against.')
+@click.option('--threshold', default=1.25, show_default=True, help='Allowed median slowdown factor before a case counts as a regression.')
+@click.option('--load', is_flag=True, help='Compare the WSGI and ASGI servers under concurrent load instead of running the cases.')
+@click.option('--concurrency', default=100, show_default=True, help='Concurrent clients in --load mode.')
+@click.option('--duration', default=10.0, show_default=True, help='Seconds of load per server in --load mode.')
+@click.option('--workers', default=1, show_default=True, help='Server worker processes in --load mode.')
+def main(sizes, repeat, output, baseline_path, threshold, load, concurrency, duration, workers):
+    results = {}
+    with app.app_context():
+        client = app.test_client()
+        for size in [int(size) for size in sizes.split(',')]:
+            click.echo('Building %d characters...' % size)
+            counts = build_database(size)
+            results[str(size)] = {}
+            if load:
+                # The servers open the database themselves; release it first.
+                db.session.remove()
+                db.engine.dispose()
+                for server in LOAD_SERVERS:
+                    result = load_test(server, counts, concurrency, duration, workers)
+                    results[str(size)]['load ' + server] = result
+                    click.echo('  %-6s %9.1f req/s  median %9.2f ms  p95 %9.2f ms  p99 %9.2f ms  %d failed' % (
+                        server, result['requests_per_s'], result['median_ms'], result['p95_ms'], result['p99_ms'], result['failures']))
+                continue
+            cases = [(name, route_sender(client, method, make_request)) for name, method, make_request in benchmark_cases(counts, repeat)]
+            for name, send in cases + serialization_cases(counts):
+                result = measure(send, repeat)
+                results[str(size)][name] = result
+                click.echo('  %-30s %9.2f ms  p95 %9.2f ms  %3d stmts  %10.1f KiB' % (
+                    name, result['median_ms'], result['p95_ms'], result['statements'], result['peak_kb']))
+
+    report = {
+        'meta': {
+            'created': datetime.utcnow().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlalchemy': sqlalchemy.__version__,
+            'sqlite': sqlite3.sqlite_version,
+            'repeat': repeat,
+            'load': {'concurrency': concurrency, 'duration': duration, 'workers': workers} if load else None,
+        },
+        'results': results,
+    }
+    if output:
+        with open(output, 'w') as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+    if baseline_path:
+        with open(baseline_path) as baseline_file:
+            if compare(results, json.load(baseline_file), threshold):
+                sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import g, current_app
+
+class MemoryBackend:
+    """In-process LRU store with a per-entry TTL."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+class RedisBackend:
+    """Shared store so every gunicorn worker sees the same entries."""
+
+    def __init__(self, url, prefix='swapi:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, value, ex=ttl)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+class ResponseCache:
+    """
+    Read-through cache for GET responses of the catalog endpoints.
+
+    Entries are keyed on the ETag @conditional_get computed for the request,
+    which hashes the URL together with the versions and table generations
+    the response is built from, as read from the database. Any committed
+    write (from this process, another worker, the admin or `flask seed`)
+    moves readers to a new key, and nothing has to be invalidated. Entries
+    for superseded states are never read again and age out through LRU/TTL.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.ttl = 300
+        self.enabled = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, backend=None):
+        self.enabled = os.getenv('CACHE_ENABLED', '1') != '0'
+        self.ttl = int(os.getenv('CACHE_TTL', 300))
+        if backend is None:
+            redis_url = os.getenv('CACHE_REDIS_URL')
+            if redis_url:
+                backend = RedisBackend(redis_url)
+            else:
+                backend = MemoryBackend(int(os.getenv('CACHE_MAX_ENTRIES', 1024)))
+        self.backend = backend
+        app.extensions['response_cache'] = self
+
+    def cached(self, view):
+        """Use below @conditional_get; requests it did not validate (missing rows) bypass the cache."""
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = g.get('etag')
+            if not self.enabled or etag is None:
+                return view(*args, **kwargs)
+            key = 'etag:' + etag
+            body = self.backend.get(key)
+            if body is not None:
+                response = current_app.response_class(body, mimetype='application/json')
+                response.headers['X-Cache'] = 'HIT'
+                return response
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                self.backend.set(key, response.get_data(), self.ttl)
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+
+cache = ResponseCache()
@@ -0,0 +1,159 @@
+import json
+from datetime import datetime, date
+import click
+from sqlalchemy import case, or_
+import search
+import stats
+from models import db, parse_number, Film, Starship, Vehicle, Species, Planet, Character, starships_films, vehicles_films, species_films, films_planets, insert_ignoring_duplicates
+
+# SWAPI resource (the path segment of its urls) -> model, in insert order so
+# every foreign key points at a row that was loaded before it.
+SWAPI_RESOURCES = [
+    ('planets', Planet),
+    ('films', Film),
+    ('species', Species),
+    ('starships', Starship),
+    ('vehicles', Vehicle),
+    ('people', Character),
+]
+
+# (resource, field listing its film urls, association table, column for the resource's id)
+SWAPI_FILM_LINKS = [
+    ('starships', 'films', starships_films, 'starship_id'),
+    ('vehicles', 'films', vehicles_films, 'vehicle_id'),
+    ('species', 'films', species_films, 'species_id'),
+    ('planets', 'films', films_planets, 'planet_id'),
+]
+
+def setup_commands(app):
+
+    @app.cli.command("seed")
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+    @click.option("--batch-size", default=500, show_default=True, help="Rows per INSERT statement.")
+    def seed(path, batch_size):
+        """
+        Load a SWAPI dump (JSON or NDJSON) into the database.
+
+        Rows are upserted on their unique url, so running it again updates
+        existing rows instead of duplicating them. Cross references between
+        resources are resolved from urls to ids in memory.
+        """
+        records = group_by_resource(read_dump(path))
+        ids = {}
+        for resource, model in SWAPI_RESOURCES:
+            rows = [to_row(model, record, ids) for record in records.get(resource, [])]
+            ids[resource] = upsert_by_url(model, rows, batch_size)
+            click.echo("%s: %d rows" % (resource, len(rows)))
+
+        for resource, field, table, own_column in SWAPI_FILM_LINKS:
+            links = []
+            for record in records.get(resource, []):
+                for film_url in record.get(field) or []:
+                    if film_url in ids['films']:
+                        links.append({own_column: ids[resource][record['url']], 'film_id': ids['films'][film_url]})
+            insert_links(table, links, batch_size)
+            click.echo("%s: %d rows" % (table.name, len(links)))
+
+        search.reindex_all()
+        db.session.commit()
+
+    @app.cli.command("search-reindex")
+    def search_reindex():
+        """Rebuild the full-text search index from the catalog tables."""
+        search.reindex_all()
+        db.session.commit()
+
+    @app.cli.command("stats-rebuild")
+    def stats_rebuild():
+        """Recompute the favorite_count summary table from the favorites table."""
+        stats.rebuild_favorite_counts()
+        db.session.commit()
+
+def read_dump(path):
+    with open(path) as dump:
+        if path.endswith(('.ndjson', '.jsonl')):
+            return [json.loads(line) for line in dump if line.strip()]
+        data = json.load(dump)
+    if isinstance(data, dict):
+        return [record for records in data.values() for record in records]
+    return data
+
+def group_by_resource(records):
+    # https://swapi.dev/api/people/1/ -> 'people'
+    grouped = {}
+    for record in records:
+        resource = record['url'].rstrip('/').split('/')[-2]
+        grouped.setdefault(resource, []).append(record)
+    return grouped
+
+def parse_value(column, value):
+    if value is None or not isinstance(value, str):
+        return value
+    if isinstance(column.type, db.DateTime):
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).replace(tzinfo=None)
+    if isinstance(column.type, db.Date):
+        return date.fromisoformat(value)
+    return value
+
+def to_row(model, record, ids):
+    row = {}
+    for column in model.__table__.columns:
+        if column.name in record and column.name != 'id':
+            row[column.name] = parse_value(column, record[column.name])
+    if 'homeworld_id' in model.__table__.columns:
+        row['homeworld_id'] = ids['planets'].get(record.get('homeworld'))
+    if model is Character:
+        # Character only keeps one film: the first one it appears in.
+        films = record.get('films') or []
+        row['film_id'] = ids['films'].get(films[0]) if films else None
+    # Core inserts skip the ORM events that keep the numeric shadows in sync.
+    for name in model.numeric_columns:
+        row[name + '_num'] = parse_number(row.get(name))
+    return row
+
+def upsert(model, names):
+    """
+    Multi-row INSERT that, when the url already exists, overwrites the given
+    columns. Only rows whose values differ are updated and get their version
+    bumped, so re-seeding unchanged data keeps their ETags valid.
+    """
+    table = model.__table__
+    columns = [name for name in names if name not in ('id', 'url', 'version')]
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        statement = insert(model)
+        changed = or_(*[table.c[name].is_distinct_from(statement.inserted[name]) for name in columns])
+        # MySQL applies the assignments in order, each seeing the ones before:
+        # version has to be decided while the old values are still there.
+        return statement.on_duplicate_key_update(
+            [('version', case((changed, table.c.version + 1), else_=table.c.version))]
+            + [(name, statement.inserted[name]) for name in columns]
+        )
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return db.insert(model)
+    statement = insert(model)
+    return statement.on_conflict_do_update(
+        index_elements=['url'],
+        set_={**{name: statement.excluded[name] for name in columns}, 'version': table.c.version + 1},
+        where=or_(*[table.c[name].is_distinct_from(statement.excluded[name]) for name in columns])
+    )
+
+def upsert_by_url(model, rows, batch_size):
+    """Upserts rows in multi-row statements and returns {url: id} for all of them."""
+    columns = sorted({name for row in rows for name in row})
+    ids = {}
+    for start in range(0, len(rows), batch_size):
+        batch = [{name: row.get(name) for name in columns} for row in rows[start:start + batch_size]]
+        db.session.execute(upsert(model, columns).values(batch))
+        urls = [row['url'] for row in batch]
+        ids.update(db.session.query(model.url, model.id).filter(model.url.in_(urls)))
+    return ids
+
+def insert_links(table, links, batch_size):
+    for start in range(0, len(links), batch_size):
+        db.session.execute(insert_ignoring_duplicates(table).values(links[start:start + batch_size]))
@@ -0,0 +1,84 @@
+import os
+import time
+from contextvars import ContextVar
+from flask import Response, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# [statement count, statement seconds] for the request being handled, if any.
+# A ContextVar rather than flask.g so cursor events fired outside an app
+# context (CLI commands, the async engine) are simply not attributed.
+request_sql = ContextVar('request_sql', default=None)
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+def setup_metrics(app):
+    """
+    Records per-route request metrics and serves them at /metrics.
+
+    Enabled with METRICS_ENABLED=1 (and prometheus_client installed); when off
+    no hooks or SQLAlchemy listeners are registered at all. Under gunicorn set
+    PROMETHEUS_MULTIPROC_DIR to an empty directory so every worker writes its
+    samples there and /metrics aggregates them (see gunicorn.conf.py).
+    """
+    if os.getenv('METRICS_ENABLED', '0') == '0':
+        return
+    from prometheus_client import Counter, Histogram, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+    from prometheus_client import multiprocess
+
+    labels = ('method', 'route')
+    requests_total = Counter('http_requests_total', 'Requests handled.', labels + ('status',))
+    latency = Histogram('http_request_duration_seconds', 'Time spent handling a request.', labels, buckets=LATENCY_BUCKETS)
+    response_bytes = Histogram('http_response_bytes', 'Size of the response body.', labels, buckets=BYTES_BUCKETS)
+    statements = Histogram('db_statements_per_request', 'SQL statements executed by a request.', labels, buckets=STATEMENT_BUCKETS)
+    statement_time = Histogram('db_statement_seconds_per_request', 'Time a request spent in SQL statements.', labels, buckets=LATENCY_BUCKETS)
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def start_statement(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+    @event.listens_for(Engine, 'after_cursor_execute')
+    def end_statement(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['metrics_started'].pop()
+        stats = request_sql.get()
+        if stats is not None:
+            stats[0] += 1
+            stats[1] += time.perf_counter() - started
+
+    def observe(method, route, status, seconds, sql_count, sql_seconds, size):
+        requests_total.labels(method, route, status).inc()
+        latency.labels(method, route).observe(seconds)
+        statements.labels(method, route).observe(sql_count)
+        statement_time.labels(method, route).observe(sql_seconds)
+        # Streamed responses (e.g. /export) have no length up front.
+        if size is not None:
+            response_bytes.labels(method, route).observe(size)
+
+    # asgi.py records the requests its async handlers serve through this.
+    app.extensions['metrics'] = observe
+
+    @app.before_request
+    def start_request():
+        g.metrics_started = time.perf_counter()
+        g.metrics_sql = request_sql.set([0, 0.0])
+
+    @app.after_request
+    def record_request(response):
+        if 'metrics_started' not in g:
+            return response
+        count, seconds = request_sql.get()
+        request_sql.reset(g.metrics_sql)
+        route = request.url_rule.rule if request.url_rule else '<unmatched>'
+        observe(request.method, route, response.status_code, time.perf_counter() - g.metrics_started,
+                count, seconds, response.content_length)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        registry = REGISTRY
+        if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
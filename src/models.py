@@ -1,8 +1,27 @@
+from flask import g, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql.expression import UpdateBase
 from datetime import datetime
 import json
+import re
 
-db = SQLAlchemy()
+class RoutingSession(Session):
+    """Sends a request's statements to the read replica chosen for it, if any (see replicas.py)."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = g.get('db_replica') if has_app_context() else None
+        if bind is None and replica is not None and not self._flushing:
+            return self._db.engines[replica]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+def as_date(column):
+    # DATE(x) exists on SQLite, Postgres and MySQL; typed as Date so the driver
+    # hands back date objects, which the JSON provider writes as YYYY-MM-DD.
+    return db.func.date(column, type_=db.Date)
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -18,25 +37,39 @@ class User(db.Model):
     def __repr__(self):
         return '<User %r>' % self.id
 
-    def serialize(self):
-        return {
+    def serialize(self, include_favorites=False):
+        data = {
             "id": self.id,
             "email": self.email,
             "username": self.username,
             "name": self.name, 
-            "last_name": self.last_name,
-            "favorites": [favorite.serialize() for favorite in self.favorites]
+            "last_name": self.last_name
         }
+        if include_favorites:
+            data["favorites"] = [favorite.serialize() for favorite in self.favorites]
+        return data
     
 class favorites(db.Model):
+    # One favorite per (user, target). NULL targets never collide, so each
+    # composite index only constrains rows of its own kind, and its leading
+    # user_id column also serves the per-user lookups.
+    __table_args__ = (
+        db.Index('uq_favorites_user_film', 'user_id', 'film_id', unique=True),
+        db.Index('uq_favorites_user_specie', 'user_id', 'specie_id', unique=True),
+        db.Index('uq_favorites_user_starship', 'user_id', 'starship_id', unique=True),
+        db.Index('uq_favorites_user_vehicle', 'user_id', 'vehicle_id', unique=True),
+        db.Index('uq_favorites_user_character', 'user_id', 'character_id', unique=True),
+        db.Index('uq_favorites_user_planet', 'user_id', 'planet_id', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    film_id = db.Column(db.Integer, db.ForeignKey('film.id'))
-    specie_id = db.Column(db.Integer, db.ForeignKey('species.id'))
-    starship_id = db.Column(db.Integer, db.ForeignKey('starship.id'))
-    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'))
-    character_id = db.Column(db.Integer, db.ForeignKey('character.id'))
-    planet_id = db.Column(db.Integer, db.ForeignKey('planet.id'))
+    film_id = db.Column(db.Integer, db.ForeignKey('film.id'), index=True)
+    specie_id = db.Column(db.Integer, db.ForeignKey('species.id'), index=True)
+    starship_id = db.Column(db.Integer, db.ForeignKey('starship.id'), index=True)
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'), index=True)
+    character_id = db.Column(db.Integer, db.ForeignKey('character.id'), index=True)
+    planet_id = db.Column(db.Integer, db.ForeignKey('planet.id'), index=True)
         
     film = db.relationship("Film", uselist=False, back_populates="favorites")
     species = db.relationship("Species", uselist=False, back_populates="favorites")
@@ -56,10 +89,46 @@ class favorites(db.Model):
             "film": self.film.title if self.film else None,
             "species": self.species.name if self.species else None,
             "starship": self.starship.name if self.starship else None,
+            "vehicle": self.vehicle.name if self.vehicle else None,
             "character": self.character.name if self.character else None,
             "planet": self.planet.name if self.planet else None
         }
 
+class FavoriteCount(db.Model):
+    """
+    Number of favorites per target, kept in step by every endpoint that adds
+    or removes favorites, so "most favorited" reads an index instead of
+    grouping the favorites table. `flask stats-rebuild` recomputes it.
+    """
+    __tablename__ = 'favorite_count'
+    __table_args__ = (
+        db.Index('ix_favorite_count_kind_count', 'kind', 'count'),
+        db.Index('ix_favorite_count_count', 'count'),
+    )
+
+    kind = db.Column(db.String(20), primary_key=True)
+    target_id = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return '<FavoriteCount %s %r>' % (self.kind, self.target_id)
+
+class TableGeneration(db.Model):
+    """
+    A counter per catalog table, bumped (with the time) by every transaction
+    that writes to the table, whatever wrote it: see bump_table_generations.
+    List ETags are built from these rows, so validating a list is a primary
+    key lookup per table instead of an aggregate over it.
+    """
+    __tablename__ = 'table_generation'
+
+    name = db.Column(db.String(50), primary_key=True)
+    generation = db.Column(db.Integer, nullable=False, default=0)
+    changed = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return '<TableGeneration %s>' % self.name
+
 starships_films = db.Table('starships_films',
                            db.Column('starship_id', db.Integer, db.ForeignKey('starship.id'), primary_key=True),
                            db.Column('film_id', db.Integer, db.ForeignKey('film.id'), primary_key=True)
@@ -89,11 +158,34 @@ class Film(db.Model):
     producer = db.Column(db.String(255), nullable=True)
     release_date = db.Column(db.Date, nullable=True)
     created = db.Column(db.DateTime, nullable=True)
-    edited = db.Column(db.DateTime, nullable=True)
+    edited = db.Column(db.DateTime, onupdate=datetime.utcnow, nullable=True)
     url = db.Column(db.String(255), unique=True, nullable=False)
+    # Bumped by every update; the row part of the detail ETag checked by If-Match.
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
 
     favorites = db.relationship("favorites", back_populates="film")
 
+    numeric_columns = ()
+    # Query-string fields accepted by the list endpoints' ?filter[...]= and ?sort=.
+    filter_fields = ("title", "episode_id", "director", "producer")
+    # Filter fields SWAPI stores as comma separated lists ("temperate, tropical"): matched per member.
+    list_fields = ("producer",)
+    sort_fields = ("title", "episode_id", "release_date", "created", "edited")
+    # Columns clients may change through PUT and the bulk PATCH endpoints.
+    editable_fields = ("title", "episode_id", "director", "opening_crawl", "producer", "release_date", "url")
+    # Tables serialize_query() reads; their generations validate list responses.
+    projection_tables = ("film",)
+    # Many-to-one relationships serialize() embeds; their row versions are part of the detail ETag.
+    embedded = ()
+    # ?include= name on the detail endpoint -> relationship it is loaded through.
+    includes = {
+        "characters": "characters",
+        "planets": "planets",
+        "starships": "starships",
+        "vehicles": "vehicles",
+        "species": "species"
+    }
+
     def __repr__(self):
         return '<Film %r>' % self.id
 
@@ -105,12 +197,21 @@ class Film(db.Model):
             "director": self.director,
             "opening_crawl": self.opening_crawl,
             "producer": self.producer,
-            "release_date": self.release_date.strftime('%Y-%m-%d'),
-            "created": self.created.strftime('%Y-%m-%d'),
-            "edited": self.edited.strftime('%Y-%m-%d'),
+            "release_date": self.release_date.strftime('%Y-%m-%d') if self.release_date else None,
+            "created": self.created.strftime('%Y-%m-%d') if self.created else None,
+            "edited": self.edited.strftime('%Y-%m-%d') if self.edited else None,
             "url": self.url
         }
 
+    @classmethod
+    def serialize_query(cls):
+        """Same fields as serialize(), projected in SQL so rows never become ORM instances."""
+        return db.session.query(
+            cls.id, cls.title, cls.episode_id, cls.director, cls.opening_crawl, cls.producer,
+            cls.release_date, as_date(cls.created).label("created"), as_date(cls.edited).label("edited"),
+            cls.url
+        )
+
 class Starship(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), nullable=False)
@@ -126,13 +227,38 @@ class Starship(db.Model):
     MGLT = db.Column(db.String(50), nullable=True)
     cargo_capacity = db.Column(db.String(50), nullable=True)
     consumables = db.Column(db.String(50), nullable=True)
+    cost_in_credits_num = db.Column(db.Float, index=True, nullable=True)
+    length_num = db.Column(db.Float, index=True, nullable=True)
+    crew_num = db.Column(db.Float, index=True, nullable=True)
+    passengers_num = db.Column(db.Float, index=True, nullable=True)
+    max_atmosphering_speed_num = db.Column(db.Float, index=True, nullable=True)
+    hyperdrive_rating_num = db.Column(db.Float, index=True, nullable=True)
+    MGLT_num = db.Column(db.Float, index=True, nullable=True)
+    cargo_capacity_num = db.Column(db.Float, index=True, nullable=True)
     created = db.Column(db.DateTime, nullable=True)
-    edited = db.Column(db.DateTime, nullable=True)
+    edited = db.Column(db.DateTime, onupdate=datetime.utcnow, nullable=True)
     url = db.Column(db.String(255), unique=True, nullable=True)
+    # Bumped by every update; the row part of the detail ETag checked by If-Match.
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
 
     films = db.relationship('Film', secondary=starships_films, backref=db.backref('starships', lazy=True))
     favorites = db.relationship("favorites", back_populates="starship")
 
+    # String columns mirrored into <name>_num floats for range filters and numeric sorts.
+    numeric_columns = ("cost_in_credits", "length", "crew", "passengers", "max_atmosphering_speed", "hyperdrive_rating", "MGLT", "cargo_capacity")
+    # Query-string fields accepted by the list endpoints' ?filter[...]= and ?sort=.
+    filter_fields = ("name", "model", "starship_class", "manufacturer")
+    # Filter fields SWAPI stores as comma separated lists ("temperate, tropical"): matched per member.
+    list_fields = ("manufacturer",)
+    sort_fields = ("name", "model", "starship_class", "created", "edited")
+    # Columns clients may change through PUT and the bulk PATCH endpoints.
+    editable_fields = ("name", "model", "starship_class", "manufacturer", "cost_in_credits", "length", "crew", "passengers",
+                       "max_atmosphering_speed", "hyperdrive_rating", "MGLT", "cargo_capacity", "consumables", "url")
+    # Tables serialize_query() reads; their generations validate list responses.
+    projection_tables = ("starship",)
+    # Many-to-one relationships serialize() embeds; their row versions are part of the detail ETag.
+    embedded = ()
+
     def __repr__(self):
         return '<Starship %r>' % self.id
 
@@ -152,11 +278,21 @@ class Starship(db.Model):
             "MGLT": self.MGLT,
             "cargo_capacity": self.cargo_capacity,
             "consumables": self.consumables,
-            "created": self.created.strftime('%Y-%m-%d'),
-            "edited": self.edited.strftime('%Y-%m-%d'),
+            "created": self.created.strftime('%Y-%m-%d') if self.created else None,
+            "edited": self.edited.strftime('%Y-%m-%d') if self.edited else None,
             "url": self.url
         }
 
+    @classmethod
+    def serialize_query(cls):
+        """Same fields as serialize(), projected in SQL so rows never become ORM instances."""
+        return db.session.query(
+            cls.id, cls.name, cls.model, cls.starship_class, cls.manufacturer, cls.cost_in_credits,
+            cls.length, cls.crew, cls.passengers, cls.max_atmosphering_speed, cls.hyperdrive_rating,
+            cls.MGLT, cls.cargo_capacity, cls.consumables,
+            as_date(cls.created).label("created"), as_date(cls.edited).label("edited"), cls.url
+        )
+
 class Vehicle(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), nullable=False)
@@ -170,13 +306,36 @@ class Vehicle(db.Model):
     max_atmosphering_speed = db.Column(db.String(50), nullable=True)
     cargo_capacity = db.Column(db.String(50), nullable=True)
     consumables = db.Column(db.String(50), nullable=True)
+    cost_in_credits_num = db.Column(db.Float, index=True, nullable=True)
+    length_num = db.Column(db.Float, index=True, nullable=True)
+    crew_num = db.Column(db.Float, index=True, nullable=True)
+    passengers_num = db.Column(db.Float, index=True, nullable=True)
+    max_atmosphering_speed_num = db.Column(db.Float, index=True, nullable=True)
+    cargo_capacity_num = db.Column(db.Float, index=True, nullable=True)
     created = db.Column(db.DateTime, nullable=True)
-    edited = db.Column(db.DateTime, nullable=True)
+    edited = db.Column(db.DateTime, onupdate=datetime.utcnow, nullable=True)
     url = db.Column(db.String(255), unique=True, nullable=True)
+    # Bumped by every update; the row part of the detail ETag checked by If-Match.
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
 
     films = db.relationship('Film', secondary=vehicles_films, backref=db.backref('vehicles', lazy=True))
     favorites = db.relationship("favorites", back_populates="vehicle")
 
+    # String columns mirrored into <name>_num floats for range filters and numeric sorts.
+    numeric_columns = ("cost_in_credits", "length", "crew", "passengers", "max_atmosphering_speed", "cargo_capacity")
+    # Query-string fields accepted by the list endpoints' ?filter[...]= and ?sort=.
+    filter_fields = ("name", "model", "vehicle_class", "manufacturer")
+    # Filter fields SWAPI stores as comma separated lists ("temperate, tropical"): matched per member.
+    list_fields = ("manufacturer",)
+    sort_fields = ("name", "model", "vehicle_class", "created", "edited")
+    # Columns clients may change through PUT and the bulk PATCH endpoints.
+    editable_fields = ("name", "model", "vehicle_class", "manufacturer", "cost_in_credits", "length", "crew", "passengers",
+                       "max_atmosphering_speed", "cargo_capacity", "consumables", "url")
+    # Tables serialize_query() reads; their generations validate list responses.
+    projection_tables = ("vehicle",)
+    # Many-to-one relationships serialize() embeds; their row versions are part of the detail ETag.
+    embedded = ()
+
     def __repr__(self):
         return '<Vehicle %r>' % self.id
 
@@ -194,11 +353,21 @@ class Vehicle(db.Model):
             "max_atmosphering_speed": self.max_atmosphering_speed,
             "cargo_capacity": self.cargo_capacity,
             "consumables": self.consumables,
-            "created": self.created.strftime('%Y-%m-%d'),
-            "edited": self.edited.strftime('%Y-%m-%d'),
+            "created": self.created.strftime('%Y-%m-%d') if self.created else None,
+            "edited": self.edited.strftime('%Y-%m-%d') if self.edited else None,
             "url": self.url
         }
 
+    @classmethod
+    def serialize_query(cls):
+        """Same fields as serialize(), projected in SQL so rows never become ORM instances."""
+        return db.session.query(
+            cls.id, cls.name, cls.model, cls.vehicle_class, cls.manufacturer, cls.cost_in_credits,
+            cls.length, cls.crew, cls.passengers, cls.max_atmosphering_speed, cls.cargo_capacity,
+            cls.consumables, as_date(cls.created).label("created"), as_date(cls.edited).label("edited"),
+            cls.url
+        )
+
 class Species(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), nullable=False)
@@ -210,15 +379,34 @@ class Species(db.Model):
     hair_colors = db.Column(db.String(255), nullable=True)
     skin_colors = db.Column(db.String(255), nullable=True)
     language = db.Column(db.String(255), nullable=False)
+    average_height_num = db.Column(db.Float, index=True, nullable=True)
+    average_lifespan_num = db.Column(db.Float, index=True, nullable=True)
     created = db.Column(db.DateTime, nullable=True)
-    edited = db.Column(db.DateTime, nullable=True)
+    edited = db.Column(db.DateTime, onupdate=datetime.utcnow, nullable=True)
     homeworld_id = db.Column(db.Integer, db.ForeignKey('planet.id'))
     url = db.Column(db.String(255), unique=True, nullable=True)
+    # Bumped by every update; the row part of the detail ETag checked by If-Match.
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
 
     homeworld = db.relationship('Planet', backref='species_homeworld', lazy=True)
     films = db.relationship('Film', secondary=species_films, backref=db.backref('species', lazy=True))
     favorites = db.relationship("favorites", back_populates="species")
 
+    # String columns mirrored into <name>_num floats for range filters and numeric sorts.
+    numeric_columns = ("average_height", "average_lifespan")
+    # Query-string fields accepted by the list endpoints' ?filter[...]= and ?sort=.
+    filter_fields = ("name", "classification", "designation", "language", "homeworld", "homeworld_id")
+    # Filter fields SWAPI stores as comma separated lists ("temperate, tropical"): matched per member.
+    list_fields = ()
+    sort_fields = ("name", "classification", "language", "created", "edited")
+    # Columns clients may change through PUT and the bulk PATCH endpoints.
+    editable_fields = ("name", "classification", "designation", "average_height", "average_lifespan", "eye_colors",
+                       "hair_colors", "skin_colors", "language", "homeworld_id", "url")
+    # Tables serialize_query() reads; their generations validate list responses.
+    projection_tables = ("species", "planet")
+    # Many-to-one relationships serialize() embeds; their row versions are part of the detail ETag.
+    embedded = ("homeworld",)
+
     def __repr__(self):
         return '<Species %r>' % self.id
 
@@ -235,11 +423,21 @@ class Species(db.Model):
             "skin_colors": self.skin_colors,
             "language": self.language,
             "homeworld": self.homeworld.name if self.homeworld else None,
-            "created": self.created.strftime('%Y-%m-%d'),
-            "edited": self.edited.strftime('%Y-%m-%d'),
+            "created": self.created.strftime('%Y-%m-%d') if self.created else None,
+            "edited": self.edited.strftime('%Y-%m-%d') if self.edited else None,
             "url": self.url
         }
 
+    @classmethod
+    def serialize_query(cls):
+        """Same fields as serialize(), projected in SQL with the homeworld name joined in."""
+        return db.session.query(
+            cls.id, cls.name, cls.classification, cls.designation, cls.average_height,
+            cls.average_lifespan, cls.eye_colors, cls.hair_colors, cls.skin_colors, cls.language,
+            Planet.name.label("homeworld"), as_date(cls.created).label("created"),
+            as_date(cls.edited).label("edited"), cls.url
+        ).outerjoin(Planet, cls.homeworld_id == Planet.id)
+
 class Planet(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), nullable=False)
@@ -251,13 +449,41 @@ class Planet(db.Model):
     climate = db.Column(db.String(255), nullable=True)
     terrain = db.Column(db.String(255), nullable=True)
     surface_water = db.Column(db.String(50), nullable=True)
+    diameter_num = db.Column(db.Float, index=True, nullable=True)
+    rotation_period_num = db.Column(db.Float, index=True, nullable=True)
+    orbital_period_num = db.Column(db.Float, index=True, nullable=True)
+    population_num = db.Column(db.Float, index=True, nullable=True)
+    surface_water_num = db.Column(db.Float, index=True, nullable=True)
     created = db.Column(db.DateTime, nullable=True)
-    edited = db.Column(db.DateTime, nullable=True)
+    edited = db.Column(db.DateTime, onupdate=datetime.utcnow, nullable=True)
     url = db.Column(db.String(255), unique=True, nullable=True)
+    # Bumped by every update; the row part of the detail ETag checked by If-Match.
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
 
     films = db.relationship('Film', secondary=films_planets, backref=db.backref('planets', lazy=True))
     favorites = db.relationship("favorites", back_populates="planet")
 
+    # String columns mirrored into <name>_num floats for range filters and numeric sorts.
+    numeric_columns = ("diameter", "rotation_period", "orbital_period", "population", "surface_water")
+    # Query-string fields accepted by the list endpoints' ?filter[...]= and ?sort=.
+    filter_fields = ("name", "climate", "terrain", "gravity")
+    # Filter fields SWAPI stores as comma separated lists ("temperate, tropical"): matched per member.
+    list_fields = ("climate", "terrain")
+    sort_fields = ("name", "climate", "terrain", "created", "edited")
+    # Columns clients may change through PUT and the bulk PATCH endpoints.
+    editable_fields = ("name", "diameter", "rotation_period", "orbital_period", "gravity", "population", "climate",
+                       "terrain", "surface_water", "url")
+    # Tables serialize_query() reads; their generations validate list responses.
+    projection_tables = ("planet",)
+    # Many-to-one relationships serialize() embeds; their row versions are part of the detail ETag.
+    embedded = ()
+    # ?include= name on the detail endpoint -> relationship it is loaded through.
+    includes = {
+        "films": "films",
+        "residents": "characters_homeworld",
+        "species": "species_homeworld"
+    }
+
     def __repr__(self):
         return '<Planet %r>' % self.id
 
@@ -278,26 +504,54 @@ class Planet(db.Model):
             "url": self.url
         }
 
+    @classmethod
+    def serialize_query(cls):
+        """Same fields as serialize(), projected in SQL so rows never become ORM instances."""
+        return db.session.query(
+            cls.id, cls.name, cls.diameter, cls.rotation_period, cls.orbital_period,
+            cls.gravity, cls.population, cls.climate, cls.terrain, cls.surface_water,
+            as_date(cls.created).label("created"), as_date(cls.edited).label("edited"), cls.url
+        )
+
 class Character(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80), nullable=False)
     eye_color = db.Column(db.String(80), nullable=True)
     skin_color = db.Column(db.String(80), nullable=True)
-    gender = db.Column(db.String(10), nullable=True)
+    gender = db.Column(db.String(20), nullable=True)
     height = db.Column(db.String(10), nullable=True)
     mass = db.Column(db.String(10), nullable=True)
     hair_color = db.Column(db.String(80), nullable=True)
     birth_year = db.Column(db.String(10), nullable=True)
     homeworld_id = db.Column(db.Integer, db.ForeignKey('planet.id'))
-    url = db.Column(db.String(120), nullable=True)
+    url = db.Column(db.String(120), unique=True, nullable=True)
+    # Bumped by every update; the row part of the detail ETag checked by If-Match.
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
     created = db.Column(db.DateTime, default=datetime.utcnow, nullable=True)
     edited = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=True)
     film_id = db.Column(db.Integer, db.ForeignKey('film.id'))
+    height_num = db.Column(db.Float, index=True, nullable=True)
+    mass_num = db.Column(db.Float, index=True, nullable=True)
 
     homeworld = db.relationship('Planet', backref='characters_homeworld', lazy=True)
     film = db.relationship('Film', backref=db.backref('characters', lazy=True))  
     favorites = db.relationship("favorites", back_populates="character") 
 
+    # String columns mirrored into <name>_num floats for range filters and numeric sorts.
+    numeric_columns = ("height", "mass")
+    # Query-string fields accepted by the list endpoints' ?filter[...]= and ?sort=.
+    filter_fields = ("name", "gender", "eye_color", "hair_color", "skin_color", "birth_year", "homeworld", "homeworld_id", "film", "film_id")
+    # Filter fields SWAPI stores as comma separated lists ("temperate, tropical"): matched per member.
+    list_fields = ("eye_color", "hair_color", "skin_color")
+    sort_fields = ("name", "gender", "birth_year", "homeworld", "created", "edited")
+    # Columns clients may change through PUT and the bulk PATCH endpoints.
+    editable_fields = ("name", "eye_color", "skin_color", "gender", "height", "mass", "hair_color", "birth_year",
+                       "homeworld_id", "film_id", "url")
+    # Tables serialize_query() reads; their generations validate list responses.
+    projection_tables = ("character", "planet", "film")
+    # Many-to-one relationships serialize() embeds; their row versions are part of the detail ETag.
+    embedded = ("homeworld", "film")
+
     def __repr__(self): 
         return '<Character %r>' % self.id  
 
@@ -314,9 +568,139 @@ class Character(db.Model):
             "birth_year": self.birth_year,
             "homeworld": self.homeworld.name if self.homeworld else None,
             "url": self.url,
-            "created": self.created.strftime('%Y-%m-%d'), 
-            "edited": self.edited.strftime('%Y-%m-%d'),  
+            "created": self.created.strftime('%Y-%m-%d') if self.created else None, 
+            "edited": self.edited.strftime('%Y-%m-%d') if self.edited else None,  
             "film": self.film.title if self.film else None 
         }
 
-      
\ No newline at end of file
+    @classmethod
+    def serialize_query(cls):
+        """Same fields as serialize(), projected in SQL with the homeworld and film names joined in."""
+        return db.session.query(
+            cls.id, cls.name, cls.eye_color, cls.skin_color, cls.gender, cls.height, cls.mass,
+            cls.hair_color, cls.birth_year, Planet.name.label("homeworld"), cls.url,
+            as_date(cls.created).label("created"), as_date(cls.edited).label("edited"),
+            Film.title.label("film")
+        ).outerjoin(Planet, cls.homeworld_id == Planet.id).outerjoin(Film, cls.film_id == Film.id)
+
+
+# Resource name in URLs -> model, for endpoints that work across the catalog.
+CATALOG_MODELS = {
+    "characters": Character,
+    "planets": Planet,
+    "starships": Starship,
+    "vehicles": Vehicle,
+    "species": Species,
+    "films": Film
+}
+
+# Kind name used by the favorites endpoints -> (target model, favorites column).
+FAVORITE_TARGETS = {
+    "film": (Film, "film_id"),
+    "species": (Species, "specie_id"),
+    "starship": (Starship, "starship_id"),
+    "vehicle": (Vehicle, "vehicle_id"),
+    "character": (Character, "character_id"),
+    "planet": (Planet, "planet_id")
+}
+
+def insert_ignoring_duplicates(model, dialect=None):
+    """INSERT that silently skips rows hitting a unique index, on the dialects that support it."""
+    dialect = dialect or db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert(model).on_conflict_do_nothing()
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        return insert(model).on_conflict_do_nothing()
+    if dialect == 'mysql':
+        return db.insert(model).prefix_with('IGNORE')
+    return db.insert(model)
+
+# Target model -> its favorites kind.
+FAVORITE_KINDS = {model: kind for kind, (model, _) in FAVORITE_TARGETS.items()}
+
+def upsert_adding(model, rows, key, column, dialect, overwrite=()):
+    """Multi-row INSERT that, where the key already exists, adds the row's column value to the stored one."""
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        statement = insert(model).values(rows)
+        return statement.on_duplicate_key_update(
+            {column: getattr(model, column) + statement.inserted[column], **{name: statement.inserted[name] for name in overwrite}}
+        )
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return db.insert(model).values(rows)
+    statement = insert(model).values(rows)
+    return statement.on_conflict_do_update(
+        index_elements=list(key),
+        set_={column: getattr(model, column) + statement.excluded[column], **{name: statement.excluded[name] for name in overwrite}}
+    )
+
+def increment_favorite_counts(targets, dialect=None):
+    """Upsert adding 1 to the count of each (kind, target_id); targets must be distinct."""
+    rows = [{'kind': kind, 'target_id': target_id, 'count': 1} for kind, target_id in targets]
+    return upsert_adding(FavoriteCount, rows, ('kind', 'target_id'), 'count', dialect or db.session.get_bind().dialect.name)
+
+def decrement_favorite_counts(kind, target_ids):
+    return db.update(FavoriteCount).where(
+        FavoriteCount.kind == kind, FavoriteCount.target_id.in_(target_ids)
+    ).values(count=FavoriteCount.count - 1)
+
+def drop_favorite_counts(kind, target_ids):
+    """For deleted targets, whose favorites lose their reference."""
+    return db.delete(FavoriteCount).where(FavoriteCount.kind == kind, FavoriteCount.target_id.in_(target_ids))
+
+def parse_number(value):
+    """'1,000' -> 1000.0, '30-165' -> 30.0, 'unknown' / 'n/a' / None -> None."""
+    if value is None:
+        return None
+    match = re.search(r'-?\d+(?:\.\d+)?', str(value).replace(',', ''))
+    return float(match.group()) if match else None
+
+def sync_numeric_columns(mapper, connection, target):
+    for name in target.numeric_columns:
+        setattr(target, name + "_num", parse_number(getattr(target, name)))
+
+def bump_version(mapper, connection, target):
+    target.version = (target.version or 0) + 1
+
+for model in (Starship, Vehicle, Species, Planet, Character):
+    db.event.listen(model, "before_insert", sync_numeric_columns)
+    db.event.listen(model, "before_update", sync_numeric_columns)
+
+for model in CATALOG_MODELS.values():
+    db.event.listen(model, "before_update", bump_version)
+
+# The catalog tables and their film link tables: a write to any of them
+# changes some catalog response, so it bumps the table's generation.
+GENERATION_TABLES = frozenset(
+    [model.__table__.name for model in CATALOG_MODELS.values()]
+    + [table.name for table in (starships_films, vehicles_films, species_films, films_planets)]
+)
+
+# Tracked at the connection level, so writes from any code path count: the
+# API, Flask-Admin, `flask seed`, other workers. Only the generation rows of
+# written tables are bumped, in one statement in name order (so concurrent
+# writers lock them in the same order), just before the transaction commits.
+
+@db.event.listens_for(Engine, 'begin')
+def clear_table_writes(conn):
+    conn.info.pop('written_tables', None)
+
+@db.event.listens_for(Engine, 'after_execute')
+def note_table_write(conn, clauseelement, multiparams, params, execution_options, result):
+    if not isinstance(clauseelement, UpdateBase) or conn.get_execution_options().get('skip_table_generations'):
+        return
+    if clauseelement.table.name in GENERATION_TABLES:
+        conn.info.setdefault('written_tables', set()).add(clauseelement.table.name)
+
+@db.event.listens_for(Engine, 'commit')
+def bump_table_generations(conn):
+    written = conn.info.pop('written_tables', None)
+    if written:
+        rows = [{'name': name, 'generation': 1, 'changed': datetime.utcnow()} for name in sorted(written)]
+        conn.execute(upsert_adding(TableGeneration, rows, ('name',), 'generation', conn.dialect.name, overwrite=('changed',)))
@@ -0,0 +1,122 @@
+import hmac
+import logging
+import os
+import time
+from contextvars import ContextVar
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# Statements recorded for the current request while a trace is requested.
+sql_trace = ContextVar('sql_trace', default=None)
+# "Model.attribute" of the lazy load about to run, attached to its statement.
+lazy_trigger = ContextVar('lazy_trigger', default=None)
+
+TRACE_HEADER = 'X-SQL-Trace'
+TRACE_ARG = 'sql_trace'
+EXPLAIN_PREFIXES = {'sqlite': 'EXPLAIN QUERY PLAN ', 'postgresql': 'EXPLAIN ', 'mysql': 'EXPLAIN '}
+
+def setup_profiler(app):
+    """
+    Two debugging aids for the SQL a request runs, both off by default.
+
+    SQL_TRACE_KEY: a request sending that key in the X-SQL-Trace header (or
+    ?sql_trace=) gets its JSON body wrapped as {"response": ..., "sql": [...]},
+    listing each statement with its parameters, duration and, for lazy loads,
+    the relationship attribute whose access issued it.
+
+    SLOW_QUERY_MS: statements taking at least that long are logged with the
+    database's plan for them. Parameters are left out of the log.
+    """
+    trace_key = os.getenv('SQL_TRACE_KEY')
+    slow_seconds = float(os.getenv('SLOW_QUERY_MS', 0)) / 1000
+    if not trace_key and not slow_seconds:
+        return
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def start_statement(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('profiler_started', []).append(time.perf_counter())
+
+    @event.listens_for(Engine, 'after_cursor_execute')
+    def end_statement(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['profiler_started'].pop()
+        trace = sql_trace.get()
+        if trace is not None:
+            trace.append({
+                'statement': statement,
+                'parameters': loggable(parameters),
+                'duration_ms': round(elapsed * 1000, 3),
+                'lazy_load': lazy_trigger.get(),
+            })
+            lazy_trigger.set(None)
+        if slow_seconds and elapsed >= slow_seconds and not executemany:
+            logger.warning('Slow query (%.1f ms): %s\n%s', elapsed * 1000, statement, explain(conn, statement, parameters))
+
+    if not trace_key:
+        return
+
+    @event.listens_for(Session, 'do_orm_execute')
+    def note_lazy_load(orm_execute_state):
+        if sql_trace.get() is None or not orm_execute_state.is_select:
+            return
+        if orm_execute_state.lazy_loaded_from is not None:
+            path = orm_execute_state.loader_strategy_path
+            lazy_trigger.set('%s.%s' % (orm_execute_state.lazy_loaded_from.class_.__name__, path[-1].key))
+
+    @app.before_request
+    def start_trace():
+        key = request.headers.get(TRACE_HEADER) or request.args.get(TRACE_ARG)
+        if key and hmac.compare_digest(key.encode(), trace_key.encode()):
+            sql_trace.set([])
+        else:
+            sql_trace.set(None)
+
+    @app.after_request
+    def attach_trace(response):
+        trace = sql_trace.get()
+        if trace is None:
+            return response
+        sql_trace.set(None)
+        response.headers['X-SQL-Count'] = str(len(trace))
+        response.headers['X-SQL-Time-Ms'] = '%.3f' % sum(entry['duration_ms'] for entry in trace)
+        if response.is_json and not response.is_streamed:
+            body = app.json.dumps({'response': response.get_json(), 'sql': trace})
+            response.set_data(body)
+        return response
+
+def loggable(parameters):
+    if isinstance(parameters, dict):
+        return {key: loggable(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [loggable(value) for value in parameters]
+    if parameters is None or isinstance(parameters, (str, int, float, bool)):
+        return parameters
+    return str(parameters)
+
+def explain(conn, statement, parameters):
+    """The plan for a statement, run on a raw cursor so it is not itself traced."""
+    prefix = EXPLAIN_PREFIXES.get(conn.dialect.name)
+    if prefix is None or not statement.lstrip().upper().startswith('SELECT'):
+        return '(no plan)'
+    # A failed statement aborts a Postgres transaction, and this one is the
+    # request's: run it inside a savepoint so a failure leaves it usable.
+    savepoint = conn.dialect.name == 'postgresql' and not getattr(conn.connection.dbapi_connection, 'autocommit', False)
+    cursor = conn.connection.cursor()
+    try:
+        if savepoint:
+            cursor.execute('SAVEPOINT explain_plan')
+        try:
+            cursor.execute(prefix + statement, parameters)
+            plan = '\n'.join(' '.join(str(value) for value in row) for row in cursor.fetchall())
+        except Exception as e:
+            if savepoint:
+                cursor.execute('ROLLBACK TO SAVEPOINT explain_plan')
+            return '(EXPLAIN failed: %s)' % e
+        if savepoint:
+            cursor.execute('RELEASE SAVEPOINT explain_plan')
+        return plan
+    finally:
+        cursor.close()
@@ -0,0 +1,52 @@
+import itertools
+import os
+from flask import g, request
+
+# Read-only requests go round-robin to the engines configured from
+# DATABASE_REPLICA_URLS (comma separated), registered as extra binds.
+# Everything else, and reads from a client that just wrote, use the primary.
+REPLICA_BIND_PREFIX = 'replica_'
+READ_PRIMARY_COOKIE = 'read_primary'
+READ_METHODS = ('GET', 'HEAD')
+
+def replica_binds(engine_options):
+    """Bind configs for the replicas; Flask-SQLAlchemy does not apply SQLALCHEMY_ENGINE_OPTIONS to binds."""
+    urls = [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+    binds = {}
+    for number, url in enumerate(urls):
+        options = dict(engine_options, url=url.replace("postgres://", "postgresql://"))
+        if options['url'].startswith('postgresql'):
+            # A lagging replica's responses are cached under the ETag read from
+            # that same replica (see cache.py), so they never shadow newer data.
+            # One snapshot per request keeps that ETag and the body it keys in
+            # step while the standby replays; replicas only serve reads, so
+            # REPEATABLE READ cannot raise serialization failures here.
+            options['isolation_level'] = 'REPEATABLE READ'
+        binds[REPLICA_BIND_PREFIX + str(number)] = options
+    return binds
+
+def sticky_seconds():
+    # How long a client that wrote keeps reading from the primary: long
+    # enough to cover replication lag after a write.
+    return int(os.getenv('DB_REPLICA_STICKY_SECONDS', 5))
+
+def setup_replicas(app):
+    bind_keys = sorted(key for key in app.config.get('SQLALCHEMY_BINDS', {}) if key.startswith(REPLICA_BIND_PREFIX))
+    if not bind_keys:
+        return
+    replicas = itertools.cycle(bind_keys)
+    max_age = sticky_seconds()
+
+    @app.before_request
+    def choose_replica():
+        if request.method not in READ_METHODS:
+            return
+        if request.cookies.get(READ_PRIMARY_COOKIE) or request.headers.get('X-Read-Primary'):
+            return
+        g.db_replica = next(replicas)
+
+    @app.after_request
+    def pin_writers_to_primary(response):
+        if request.method not in READ_METHODS and response.status_code < 400:
+            response.set_cookie(READ_PRIMARY_COOKIE, '1', max_age=max_age, httponly=True)
+        return response
@@ -0,0 +1,137 @@
+import re
+from sqlalchemy import event, MetaData, Table, Column, BigInteger, Integer, String, Text
+from models import db, Film, Starship, Vehicle, Species, Planet, Character
+
+# resource -> (model, code, columns weighted as the name, columns indexed as body text).
+# The code makes the index row id unique across resources: entity_id * 8 + code.
+SEARCH_RESOURCES = {
+    'characters': (Character, 1, ('name',), ()),
+    'planets': (Planet, 2, ('name',), ()),
+    'starships': (Starship, 3, ('name', 'model'), ()),
+    'vehicles': (Vehicle, 4, ('name', 'model'), ()),
+    'species': (Species, 5, ('name',), ()),
+    'films': (Film, 6, ('title',), ('opening_crawl',)),
+}
+
+# Outside db.metadata: SQLite needs an FTS5 virtual table instead, and
+# autogenerate leaves search_index alone (see migrations/env.py).
+SEARCH_INDEX = Table('search_index', MetaData(),
+    Column('id', BigInteger, primary_key=True, autoincrement=False),
+    Column('kind', String(20), nullable=False),
+    Column('entity_id', Integer, nullable=False),
+    Column('name', Text),
+    Column('body', Text),
+)
+
+def create_index_table(connection):
+    """
+    Creates search_index, unless it exists, on the connection's database:
+    an FTS5 table on SQLite, where the index row id is the rowid, and a
+    plain table elsewhere, with a weighted tsvector column on Postgres.
+    Shared by the migration and db.create_all().
+    """
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        connection.exec_driver_sql(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+            "kind UNINDEXED, entity_id UNINDEXED, name, body, tokenize='unicode61 remove_diacritics 2')"
+        )
+        return
+    if db.inspect(connection).has_table('search_index'):
+        return
+    SEARCH_INDEX.create(connection)
+    if dialect == 'postgresql':
+        connection.exec_driver_sql(
+            "ALTER TABLE search_index ADD COLUMN document tsvector GENERATED ALWAYS AS ("
+            "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+            "setweight(to_tsvector('simple', coalesce(body, '')), 'B')) STORED"
+        )
+        connection.exec_driver_sql('CREATE INDEX ix_search_index_document ON search_index USING gin (document)')
+
+@event.listens_for(db.metadata, 'after_create')
+def create_with_metadata(target, connection, **kw):
+    create_index_table(connection)
+
+@event.listens_for(db.metadata, 'after_drop')
+def drop_with_metadata(target, connection, **kw):
+    connection.exec_driver_sql('DROP TABLE IF EXISTS search_index')
+
+def _dialect():
+    return db.session.get_bind().dialect.name
+
+def _key_column():
+    # FTS5 tables have no declared key; the index row id is stored as the rowid.
+    return 'rowid' if _dialect() == 'sqlite' else 'id'
+
+def _text(obj, columns):
+    return ' '.join(getattr(obj, column) or '' for column in columns)
+
+def index_entity(resource, obj):
+    """Adds or refreshes obj in the search index; call before the write handler commits."""
+    _, code, name_columns, body_columns = SEARCH_RESOURCES[resource]
+    remove_entity(resource, obj.id)
+    db.session.execute(
+        db.text('INSERT INTO search_index (%s, kind, entity_id, name, body) VALUES (:id, :kind, :entity_id, :name, :body)' % _key_column()),
+        {'id': obj.id * 8 + code, 'kind': resource, 'entity_id': obj.id,
+         'name': _text(obj, name_columns), 'body': _text(obj, body_columns)}
+    )
+
+def remove_entity(resource, entity_id):
+    remove_entities(resource, [entity_id])
+
+def remove_entities(resource, entity_ids):
+    code = SEARCH_RESOURCES[resource][1]
+    db.session.execute(
+        db.text('DELETE FROM search_index WHERE %s IN :ids' % _key_column()).bindparams(db.bindparam('ids', expanding=True)),
+        {'ids': [entity_id * 8 + code for entity_id in entity_ids]}
+    )
+
+def _index_rows(resource, entity_ids=None):
+    # One INSERT ... SELECT over the resource's table, optionally limited to some ids.
+    model, code, name_columns, body_columns = SEARCH_RESOURCES[resource]
+    columns = [db.func.coalesce(getattr(model, column), '') for column in name_columns]
+    name = columns[0]
+    for column in columns[1:]:
+        name = name + ' ' + column
+    body = db.func.coalesce(getattr(model, body_columns[0]), '') if body_columns else db.literal('')
+    source = db.select(model.id * 8 + code, db.literal(resource), model.id, name, body)
+    if entity_ids is not None:
+        source = source.where(model.id.in_(entity_ids))
+    table = db.table('search_index', db.column(_key_column()), db.column('kind'), db.column('entity_id'),
+                     db.column('name'), db.column('body'))
+    db.session.execute(table.insert().from_select([_key_column(), 'kind', 'entity_id', 'name', 'body'], source))
+
+def reindex_entities(resource, entity_ids):
+    """Refreshes the given rows after a bulk UPDATE; call before committing."""
+    remove_entities(resource, entity_ids)
+    _index_rows(resource, entity_ids)
+
+def reindex_all():
+    """Rebuilds the whole index with one INSERT ... SELECT per resource."""
+    db.session.execute(db.text('DELETE FROM search_index'))
+    for resource in SEARCH_RESOURCES:
+        _index_rows(resource)
+
+def search(q, limit, offset):
+    """Returns up to limit (kind, entity_id, name, score) rows, best match first."""
+    terms = re.findall(r'\w+', q.lower())
+    if not terms:
+        return []
+    params = {'limit': limit, 'offset': offset}
+    dialect = _dialect()
+    if dialect == 'sqlite':
+        # Every term must match, as a prefix; a name hit weighs 10x a body hit.
+        params['q'] = ' '.join('"%s"*' % term for term in terms)
+        sql = ('SELECT kind, entity_id, name, -bm25(search_index, 0.0, 0.0, 10.0, 1.0) AS score '
+               'FROM search_index WHERE search_index MATCH :q '
+               'ORDER BY bm25(search_index, 0.0, 0.0, 10.0, 1.0), rowid LIMIT :limit OFFSET :offset')
+    elif dialect == 'postgresql':
+        params['q'] = ' & '.join(term + ':*' for term in terms)
+        sql = ('SELECT kind, entity_id, name, ts_rank(document, query) AS score '
+               'FROM search_index, to_tsquery(\'simple\', :q) AS query WHERE document @@ query '
+               'ORDER BY score DESC, id LIMIT :limit OFFSET :offset')
+    else:
+        params['q'] = '%' + '%'.join(terms) + '%'
+        sql = ('SELECT kind, entity_id, name, 1.0 AS score FROM search_index '
+               'WHERE name LIKE :q OR body LIKE :q ORDER BY name, id LIMIT :limit OFFSET :offset')
+    return db.session.execute(db.text(sql), params).all()
@@ -0,0 +1,56 @@
+from sqlalchemy import func
+from models import db, favorites, FavoriteCount, FAVORITE_TARGETS
+from utils import APIException
+
+def rebuild_favorite_counts():
+    """Recomputes the favorite_count summary from the favorites table; call before committing."""
+    db.session.execute(db.delete(FavoriteCount))
+    for kind, (_, column_name) in FAVORITE_TARGETS.items():
+        column = getattr(favorites, column_name)
+        source = (db.select(db.literal(kind), column, func.count())
+                  .where(column.isnot(None))
+                  .group_by(column))
+        db.session.execute(db.insert(FavoriteCount).from_select(['kind', 'target_id', 'count'], source))
+
+def group_counts(model, field, limit):
+    """Rows per distinct value of one of model.filter_fields, largest groups first, counted in SQL."""
+    if field not in model.filter_fields:
+        raise APIException("Cannot group by '%s'" % field, status_code=400)
+    if field in model.__table__.columns:
+        # A plain column: group the table alone, without the projection's joins.
+        column = model.__table__.columns[field]
+        query = db.session.query(column, func.count())
+    else:
+        query = model.serialize_query()
+        column = {column.name: column for column in query.statement.selected_columns}[field]
+        query = query.with_entities(column, func.count(model.id))
+    rows = query.group_by(column).order_by(func.count().desc(), column).limit(limit).all()
+    return [{field: value, 'count': count} for value, count in rows]
+
+def favorite_totals():
+    rows = (db.session.query(FavoriteCount.kind, func.sum(FavoriteCount.count))
+            .group_by(FavoriteCount.kind).order_by(FavoriteCount.kind).all())
+    return [{'kind': kind, 'count': int(total or 0)} for kind, total in rows]
+
+def top_favorites(kind, limit):
+    """The most favorited targets (of one kind, or of all), read off the summary table's count index."""
+    query = db.session.query(FavoriteCount.kind, FavoriteCount.target_id, FavoriteCount.count).filter(FavoriteCount.count > 0)
+    if kind is not None:
+        if kind not in FAVORITE_TARGETS:
+            raise APIException('Unknown favorite kind: ' + kind, status_code=400)
+        query = query.filter(FavoriteCount.kind == kind)
+    rows = query.order_by(FavoriteCount.count.desc(), FavoriteCount.kind, FavoriteCount.target_id).limit(limit).all()
+
+    # One name lookup per kind present in the page.
+    ids_by_kind = {}
+    for row in rows:
+        ids_by_kind.setdefault(row.kind, []).append(row.target_id)
+    names = {}
+    for row_kind, ids in ids_by_kind.items():
+        model = FAVORITE_TARGETS[row_kind][0]
+        name = model.name if hasattr(model, 'name') else model.title
+        names.update(((row_kind, target_id), value) for target_id, value in db.session.query(model.id, name).filter(model.id.in_(ids)))
+    return [
+        {'kind': row.kind, 'id': row.target_id, 'name': names.get((row.kind, row.target_id)), 'count': row.count}
+        for row in rows
+    ]
@@ -0,0 +1,50 @@
+import os
+import sys
+import tempfile
+
+# The app reads its configuration at import: point it at a throwaway SQLite
+# database, with response caching off so every request reaches the database.
+DATABASE_PATH = os.path.join(tempfile.mkdtemp(), 'test.db')
+os.environ['DATABASE_URL'] = 'sqlite:///' + DATABASE_PATH
+os.environ['CACHE_ENABLED'] = '0'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from datetime import datetime, date
+import pytest
+from app import app
+from models import db, User, Film, Planet, Character, favorites
+
+def seed(rows):
+    """rows planets, characters and users; every user favorites every character and planet."""
+    now = datetime(2024, 1, 1)
+    db.drop_all()
+    db.create_all()
+    film = Film(title='A New Hope', episode_id=4, release_date=date(1977, 5, 25), created=now, edited=now, url='films/1')
+    planets = [Planet(name='Planet %d' % i, created=now, edited=now, url='planets/%d' % i) for i in range(rows)]
+    film.planets.extend(planets)
+    db.session.add(film)
+    db.session.flush()
+    characters = [
+        Character(name='Character %d' % i, gender='female', homeworld_id=planets[i].id, film_id=film.id, url='people/%d' % i)
+        for i in range(rows)
+    ]
+    users = [
+        User(email='user%d@example.com' % i, password='secret', username='user%d' % i, name='User', last_name=str(i))
+        for i in range(rows)
+    ]
+    db.session.add_all(characters + users)
+    db.session.flush()
+    db.session.add_all(
+        favorites(user_id=user.id, character_id=character.id, planet_id=None) for user in users for character in characters
+    )
+    db.session.add_all(
+        favorites(user_id=user.id, planet_id=planet.id) for user in users for planet in planets
+    )
+    db.session.commit()
+
+@pytest.fixture
+def client():
+    """A test client over a freshly built database holding seed(3)."""
+    with app.app_context():
+        seed(3)
+        yield app.test_client()
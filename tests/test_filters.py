@@ -0,0 +1,18 @@
+"""?filter[...] on the list endpoints."""
+
+def names(response):
+    return sorted(row['name'] for row in response.get_json()['results'])
+
+def test_list_fields_match_members(client):
+    client.patch('/planets', json={'updates': [
+        {'id': 1, 'changes': {'climate': 'temperate, tropical'}},
+        {'id': 2, 'changes': {'climate': 'tropical'}},
+        {'id': 3, 'changes': {'climate': 'arid'}},
+    ]})
+    assert names(client.get('/planets?filter[climate]=tropical')) == ['Planet 0', 'Planet 1']
+    assert names(client.get('/planets?filter[climate]=temperate, arid')) == ['Planet 0', 'Planet 2']
+    assert names(client.get('/planets?filter[climate]=temp')) == []
+
+def test_plain_fields_match_exactly(client):
+    assert names(client.get('/characters?filter[name]=Character 0, Character 2')) == ['Character 0', 'Character 2']
+    assert names(client.get('/characters?filter[name]=Character')) == []
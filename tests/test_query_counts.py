@@ -0,0 +1,47 @@
+"""
+The list and favorites routes must issue a fixed number of SQL statements,
+however many rows they return (no N+1 lazy loads).
+"""
+import pytest
+from sqlalchemy import event
+from app import app
+from models import db
+from conftest import seed
+
+ROUTES = [
+    '/characters',
+    '/character/1',
+    '/planets',
+    '/favorites',
+    '/users/favorites?user_id=1',
+    '/users?expand=favorites',
+]
+# The conditional-GET validators, then the page with its related rows.
+MAX_STATEMENTS = 3
+
+def statement_counts(rows):
+    counts = {}
+    with app.app_context():
+        seed(rows)
+        client = app.test_client()
+        for path in ROUTES:
+            executed = []
+            listener = lambda *args: executed.append(args)
+            event.listen(db.engine, 'after_cursor_execute', listener)
+            try:
+                response = client.get(path)
+            finally:
+                event.remove(db.engine, 'after_cursor_execute', listener)
+            assert response.status_code == 200, path
+            counts[path] = len(executed)
+    return counts
+
+@pytest.fixture(scope='module')
+def counts():
+    return statement_counts(1), statement_counts(50)
+
+@pytest.mark.parametrize('path', ROUTES)
+def test_statements_do_not_grow_with_rows(counts, path):
+    one, fifty = counts
+    assert one[path] == fifty[path]
+    assert fifty[path] <= MAX_STATEMENTS
@@ -0,0 +1,36 @@
+"""
+Catalog writes on a database built with db.create_all(), which must also
+create the search index they keep up to date.
+"""
+
+def test_create_update_delete(client):
+    response = client.post('/characters', json={'name': 'Luke', 'height': '172', 'homeworld_id': 1})
+    assert response.status_code == 201
+    character_id = response.get_json()['character_id']
+    assert client.put('/character/%d' % character_id, json={'name': 'Luke Skywalker'}).status_code == 200
+    assert client.get('/search?q=skywalker').get_json()['results'][0]['id'] == character_id
+    assert client.delete('/character/%d' % character_id).status_code == 200
+    assert client.get('/search?q=skywalker').get_json()['results'] == []
+
+def test_bulk_update_and_delete(client):
+    response = client.patch('/planets', json={'updates': [{'id': 1, 'changes': {'name': 'Tatooine'}}]})
+    assert response.get_json()['results'] == [{'id': 1, 'status': 'updated'}]
+    response = client.delete('/planets', json={'ids': [1, 99]})
+    assert [result['status'] for result in response.get_json()['results']] == ['deleted', 'not_found']
+    assert client.get('/search?q=tatooine').get_json()['results'] == []
+
+def test_bulk_delete_invalidates_children(client):
+    etag = client.get('/character/1').headers['ETag']
+    client.delete('/planets', json={'ids': [1]})
+    response = client.put('/character/1', json={'name': 'Stale'}, headers={'If-Match': etag})
+    assert response.status_code == 412
+
+def test_bulk_bodies_must_be_objects(client):
+    assert client.patch('/films', json=[{'id': 1, 'changes': {'title': 'x'}}]).status_code == 400
+    assert client.delete('/films', json=[1]).status_code == 400
+
+def test_detail_with_null_dates(client):
+    client.patch('/films', json={'updates': [{'id': 1, 'changes': {'release_date': None}}]})
+    response = client.get('/film/1')
+    assert response.status_code == 200
+    assert response.get_json()['release_date'] is None